@@ -1,48 +1,144 @@
 import asyncio
-from aiogram import Bot, Dispatcher
+import time
+from typing import Any, Awaitable
+
+from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN
-from database import db
-from utils import log
-from features import setup_routers
+from config import BOT_TOKEN, FSM_REDIS_DB, UPDATES_MAX_PENDING, BOT_MODE, METRICS_HOST, METRICS_PORT
+from database import db, cache, chat_index
+from dispatcher import create_dispatcher
+from features.broadcast.logic import resume_broadcasts, stop_broadcasts
+from lifecycle import Lifecycle
+from outgoing import OutgoingScheduler
+from utils import log, metrics, profiler
+from utils.logger import get_log_dir, stop_logger
+from utils.markup import MarkupCachingSession
+import middleware
 import redis_
 
 
+async def _timed(timings: dict[str, float], name: str, aw: Awaitable[Any]) -> Any:
+    started = time.perf_counter()
+    try:
+        return await aw
+    finally:
+        timings[name] = time.perf_counter() - started
+
+
+async def _close_opened(resources: list[Any], bot: Bot) -> None:
+    """
+    Запуск не удался: закрывает подключения, которые успели открыться
+    :param resources: результаты gather - пул, реплики, клиенты Redis, ошибки вместо неудавшихся
+    """
+    closers = []
+    for resource in resources:
+        if resource is None or isinstance(resource, BaseException):
+            continue
+        close = getattr(resource, "aclose", None) or getattr(resource, "close", None)
+        if close is not None:
+            closers.append(close())
+    await asyncio.gather(*closers, return_exceptions=True)
+    await bot.session.close()
+
+
 async def main() -> None:
-    pool = await db.connect_db()
-    rd = await redis_.config.init_redis()
-    await db.postgres_version(pool)
+    log.info("Нам IIZ6a!")
+    started = time.perf_counter()
+    timings: dict[str, float] = {}
     bot = Bot(
         token=BOT_TOKEN,
+        session=MarkupCachingSession(),
         default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN)
     )
-    dp = Dispatcher(storage=MemoryStorage())
-    dp["pool"] = pool
-    dp["redis"] = rd
+    # Планировщик первым: метрики Bot API меряют сам запрос, без ожидания в очереди
+    bot.session.middleware(OutgoingScheduler())
+    bot.session.middleware(middleware.ApiMetricsMiddleware())
+
+    # Подключения не зависят друг от друга - открываем одновременно.
+    # Пул стартует с одним подключением, остальные открывает warm_up уже после запуска
+    results = await asyncio.gather(
+        _timed(timings, "postgres", db.connect_db(min_size=1)),
+        _timed(timings, "replicas", db.connect_replicas()),
+        _timed(timings, "redis", redis_.config.init_redis()),
+        # FSM хранит данные в msgpack, поэтому отдельный клиент без декодирования ответов
+        _timed(timings, "redis_fsm", redis_.config.init_redis(db=FSM_REDIS_DB, decode_responses=False)),
+        _timed(timings, "bot", bot.me()),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        await _close_opened(results[:4], bot)
+        raise errors[0]
+    pool, replicas, rd, fsm_rd, _ = results
+    dp = create_dispatcher(pool=pool, redis=rd, fsm_redis=fsm_rd, replicas=replicas)
+    lifecycle = Lifecycle(dp)
+    metrics_runner = None
+    warm_up = None
+    chat_sync = None
 
     async def on_startup() -> None:
-        log.info("Bot start")
+        nonlocal metrics_runner, warm_up, chat_sync
+        if METRICS_PORT:
+            metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+            log.info(f"Метрики доступны на {METRICS_HOST}:{METRICS_PORT}/metrics")
+        warm_up = asyncio.create_task(db.warm_up(pool))
+        # Индекс загружается в фоне, апдейты из групп ждут его в ChatAllianceMiddleware
+        chat_sync = chat_index.start(pool, rd)
+        await resume_broadcasts(bot, pool, rd)
+        profiler.install_signal_handler()
+        log.info(f"Bot start за {(time.perf_counter() - started) * 1000:.0f} мс: "
+                 + ", ".join(f"{name}={seconds * 1000:.0f} мс" for name, seconds in timings.items()))
 
-    async def on_shutdown() -> None:
-        await dp.storage.close()
-        await dp["pool"].close()
-        await bot.session.close()
-        log.info("Bot finish")
+    async def close_metrics() -> None:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        metrics.dump(str(get_log_dir() / "metrics.prom"))
 
-    dp.startup.register(on_startup)
-    dp.shutdown.register(on_shutdown)
+    async def close_warm_up() -> None:
+        if warm_up is not None:
+            warm_up.cancel()
+
+    async def close_chat_sync() -> None:
+        if chat_sync is not None:
+            chat_sync.cancel()
+            await asyncio.gather(chat_sync, return_exceptions=True)
 
-    # Регаем мидлваеры
-    # dp.message.middleware(middleware.DBMiddleware(pool=pool, redis=rd))
+    async def on_finish() -> None:
+        log.info(f"Кэш альянсов за сессию: {cache.stats()}")
+        log.info("Bot finish")
+
+    # Закрываются по порядку после обработки апдейтов: профиль, рассылки, индекс чатов, метрики, Redis, БД, сессия Bot API
+    lifecycle.on_close("прогрев пула", close_warm_up)
+    lifecycle.on_close("профилировщик", profiler.stop)
+    lifecycle.on_close("рассылки", stop_broadcasts)
+    lifecycle.on_close("индекс чатов", close_chat_sync)
+    lifecycle.on_close("метрики", close_metrics)
+    lifecycle.on_close("хранилище FSM", dp.storage.close)
+    lifecycle.on_close("redis", rd.aclose)
+    if replicas is not None:
+        lifecycle.on_close("реплики БД", replicas.close)
+    lifecycle.on_close("пул БД", pool.close)
+    lifecycle.on_close("сессия бота", bot.session.close)
+    lifecycle.on_close("лог", on_finish)
 
-    # Регам роуторы
-    dp.include_router(setup_routers())
+    dp.startup.register(on_startup)
+    dp.shutdown.register(lifecycle.shutdown)
 
-    await dp.start_polling(bot, handle_as_tasks=False)
+    if BOT_MODE == "webhook":
+        # aiohttp-сервер нужен только в режиме вебхука
+        import webhook
+        await webhook.run_webhook(dp, bot)
+    else:
+        await dp.start_polling(bot,
+                               handle_as_tasks=True,
+                               tasks_concurrency_limit=UPDATES_MAX_PENDING)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    finally:
+        # Дописываем хвост очереди логов, даже если бот упал
+        stop_logger()
@@ -0,0 +1,71 @@
+"""
+Микробенчмарк отрисовки меню: сборка клавиатуры + подготовка тела запроса к Bot API.
+Сравнивает сборку клавиатур заново на каждый вызов (как раньше) с готовыми клавиатурами из utils.markup.
+
+Запуск из корня репозитория:
+    python -m benchmarks.keyboards
+"""
+import time
+import tracemalloc
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import EditMessageText
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from features.settings_alliance.keyboards import action_keyboard, alliance_list_keyboard
+from utils.markup import MarkupCachingSession
+
+ROUNDS = 5000
+PAGE = {"items": [{"id": i, "name": f"Альянс {i}"} for i in range(1, 6)], "has_prev": True, "has_next": True}
+
+
+def fresh_copy(markup: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+    # Так клавиатуры собирались до кэширования - новые pydantic-модели на каждый вызов
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=button.text, callback_data=button.callback_data) for button in row]
+        for row in markup.inline_keyboard
+    ])
+
+
+def render_fresh(session: AiohttpSession, bot: Bot) -> None:
+    for markup in (action_keyboard(True), alliance_list_keyboard(PAGE)):
+        method = EditMessageText(chat_id=1, message_id=1, text="menu", reply_markup=fresh_copy(markup))
+        session.build_form_data(bot=bot, method=method)
+
+
+def render_cached(session: AiohttpSession, bot: Bot) -> None:
+    for markup in (action_keyboard(True), alliance_list_keyboard(PAGE)):
+        method = EditMessageText(chat_id=1, message_id=1, text="menu", reply_markup=markup)
+        session.build_form_data(bot=bot, method=method)
+
+
+def measure(name: str, render, session: AiohttpSession, bot: Bot) -> None:
+    render(session, bot)
+
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        render(session, bot)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(100):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        render(session, bot)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    print(f"{name:<8} {elapsed / ROUNDS * 1e6:8.1f} мкс/меню   "
+          f"{sum(peaks) / len(peaks):8.0f} байт пиковой памяти/меню")
+
+
+def main() -> None:
+    bot = Bot("1:benchmark")
+    measure("fresh", render_fresh, AiohttpSession(), bot)
+    measure("cached", render_cached, MarkupCachingSession(), bot)
+
+
+if __name__ == "__main__":
+    main()
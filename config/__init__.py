@@ -5,6 +5,54 @@ from .config import (BOT_TOKEN,
                      DB_NAME,
                      DB_PORT,
                      REDIS_PORT,
-                     REDIS_PASSWORD)
+                     REDIS_PASSWORD,
+                     ALLIANCE_CACHE_TTL,
+                     AUTH_CACHE_SIZE,
+                     AUTH_CACHE_TTL,
+                     PLAYER_ID_CACHE_SIZE,
+                     PLAYER_ID_REDIS_TTL,
+                     DB_POOL_MIN_SIZE,
+                     DB_POOL_MAX_SIZE,
+                     DB_POOL_MAX_INACTIVE_LIFETIME,
+                     DB_STATEMENT_CACHE_SIZE,
+                     DB_COMMAND_TIMEOUT,
+                     DB_REPLICAS,
+                     DB_REPLICA_MAX_LAG,
+                     DB_REPLICA_CHECK_INTERVAL,
+                     DB_REPLICA_PIN_SECONDS,
+                     FSM_REDIS_DB,
+                     FSM_STATE_TTL,
+                     FSM_DATA_TTL,
+                     UPDATES_MAX_IN_FLIGHT,
+                     UPDATES_MAX_PENDING,
+                     BOT_MODE,
+                     WEBHOOK_URL,
+                     WEBHOOK_PATH,
+                     WEBHOOK_SECRET,
+                     WEBHOOK_HOST,
+                     WEBHOOK_PORT,
+                     WEBHOOK_QUEUE_SIZE,
+                     DB_UPDATE_TRANSACTION,
+                     KEYBOARD_CACHE_SIZE,
+                     METRICS_HOST,
+                     METRICS_PORT,
+                     BIND_REQUEST_TTL,
+                     SHUTDOWN_DRAIN_TIMEOUT,
+                     THROTTLE_ENABLED,
+                     THROTTLE_RATE,
+                     THROTTLE_BURST,
+                     THROTTLE_LIMITS,
+                     OUTGOING_GLOBAL_RATE,
+                     OUTGOING_CHAT_RATE,
+                     OUTGOING_GROUP_RATE,
+                     OUTGOING_CHAT_BURST,
+                     OUTGOING_MAX_RETRIES,
+                     BOT_ADMINS,
+                     BROADCAST_CONCURRENCY,
+                     BROADCAST_BATCH_SIZE,
+                     BROADCAST_SWEEP_INTERVAL,
+                     PROFILE_SAMPLE_INTERVAL,
+                     PROFILE_DEFAULT_SECONDS,
+                     PROFILE_MAX_SECONDS)
 
 
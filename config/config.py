@@ -3,11 +3,140 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def _int(name: str, default: int) -> int:
+    """
+    Целое из переменной окружения. Пустое или отсутствующее значение - default
+    """
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Переменная окружения {name} должна быть целым числом, получено {value!r}")
+
+
+def _float(name: str, default: float) -> float:
+    """
+    Число из переменной окружения. Пустое или отсутствующее значение - default
+    """
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Переменная окружения {name} должна быть числом, получено {value!r}")
+
+
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 DB_NAME = os.getenv('DB_NAME')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_HOST = os.getenv('DB_HOST')
-DB_PORT = int(os.getenv('DB_PORT'))
-REDIS_PORT = int(os.getenv('REDIS_PORT'))
-REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
\ No newline at end of file
+DB_PORT = _int('DB_PORT', 5432)
+REDIS_PORT = _int('REDIS_PORT', 6379)
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD')
+ALLIANCE_CACHE_TTL = _int('ALLIANCE_CACHE_TTL', 600)
+# Кэш проверки мастера альянса в памяти процесса
+AUTH_CACHE_SIZE = _int('AUTH_CACHE_SIZE', 10000)
+AUTH_CACHE_TTL = _float('AUTH_CACHE_TTL', 30)
+# Кэш tg_id -> players.id: в памяти процесса (LRU) и вторым уровнем в редисе, 0 - без редиса.
+# id игрока не меняется, поэтому TTL только ограничивает память редиса
+PLAYER_ID_CACHE_SIZE = _int('PLAYER_ID_CACHE_SIZE', 100000)
+PLAYER_ID_REDIS_TTL = _int('PLAYER_ID_REDIS_TTL', 7 * 24 * 60 * 60)
+
+# Пул подключений к PostgreSQL
+DB_POOL_MIN_SIZE = _int('DB_POOL_MIN_SIZE', 1)
+DB_POOL_MAX_SIZE = _int('DB_POOL_MAX_SIZE', 10)
+DB_POOL_MAX_INACTIVE_LIFETIME = _float('DB_POOL_MAX_INACTIVE_LIFETIME', 300)
+DB_STATEMENT_CACHE_SIZE = _int('DB_STATEMENT_CACHE_SIZE', 100)
+DB_COMMAND_TIMEOUT = _float('DB_COMMAND_TIMEOUT', 60)
+
+# Реплики PostgreSQL для чтения: host или host:port через запятую, пусто - всё читается с primary.
+# Реплика, отставшая больше DB_REPLICA_MAX_LAG секунд или недоступная, не получает чтений до следующей проверки.
+# Пользователь после своей записи DB_REPLICA_PIN_SECONDS читает с primary, чтобы сразу видеть изменения.
+# Закрепление хранится в Redis (pin:{tg_id}) и действует во всех экземплярах бота
+DB_REPLICAS = [host.strip() for host in os.getenv('DB_REPLICAS', '').split(',') if host.strip()]
+DB_REPLICA_MAX_LAG = _float('DB_REPLICA_MAX_LAG', 1)
+DB_REPLICA_CHECK_INTERVAL = _float('DB_REPLICA_CHECK_INTERVAL', 1)
+DB_REPLICA_PIN_SECONDS = _float('DB_REPLICA_PIN_SECONDS', 5)
+
+# Хранилище FSM в Redis
+FSM_REDIS_DB = _int('FSM_REDIS_DB', 0)
+FSM_STATE_TTL = _int('FSM_STATE_TTL', 24 * 60 * 60)
+FSM_DATA_TTL = _int('FSM_DATA_TTL', 24 * 60 * 60)
+
+# Параллельная обработка апдейтов
+# Одновременно выполняемых апдейтов - не больше, чем подключений в пуле
+UPDATES_MAX_IN_FLIGHT = _int('UPDATES_MAX_IN_FLIGHT', DB_POOL_MAX_SIZE)
+# Сколько апдейтов может ждать своей очереди, прежде чем поллинг притормозит
+UPDATES_MAX_PENDING = _int('UPDATES_MAX_PENDING', 100)
+
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = _int('WEBHOOK_PORT', 8080)
+WEBHOOK_QUEUE_SIZE = _int('WEBHOOK_QUEUE_SIZE', 1000)
+
+# Выполнять все запросы одного апдейта в одной транзакции
+DB_UPDATE_TRANSACTION = os.getenv('DB_UPDATE_TRANSACTION', 'false').lower() in ('1', 'true', 'yes')
+
+# Сколько готовых клавиатур держать вместе с их JSON
+KEYBOARD_CACHE_SIZE = _int('KEYBOARD_CACHE_SIZE', 1024)
+
+
+# Эндпоинт /metrics в формате Prometheus, METRICS_PORT=0 - выключен
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = _int('METRICS_PORT', 0)
+
+# Сколько секунд живёт заявка на привязку чата к альянсу
+BIND_REQUEST_TTL = _int('BIND_REQUEST_TTL', 5 * 60)
+
+# Сколько секунд при остановке ждать обработки уже принятых апдейтов
+SHUTDOWN_DRAIN_TIMEOUT = _float('SHUTDOWN_DRAIN_TIMEOUT', 25)
+
+
+def _limits(value: str) -> dict[str, tuple[float, int]]:
+    """
+    Разбирает лимиты вида "router=rate:burst,router=rate:burst"
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, limit = item.partition('=')
+        rate, _, burst = limit.partition(':')
+        limits[name.strip()] = (float(rate), int(burst))
+    return limits
+
+
+# Ограничение частоты апдейтов: rate - токенов в секунду, burst - сколько апдейтов можно подряд.
+# Общий лимит действует на все апдейты пользователя/чата, THROTTLE_LIMITS - дополнительно на роуторы
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+THROTTLE_RATE = _float('THROTTLE_RATE', 3)
+THROTTLE_BURST = _int('THROTTLE_BURST', 10)
+THROTTLE_LIMITS = _limits(os.getenv('THROTTLE_LIMITS', 'settings_alliance=2:8,add_alliance=1:5,add_guild=1:5'))
+
+# Лимиты исходящих запросов к Bot API, запросов в секунду
+OUTGOING_GLOBAL_RATE = _float('OUTGOING_GLOBAL_RATE', 30)
+OUTGOING_CHAT_RATE = _float('OUTGOING_CHAT_RATE', 1)
+OUTGOING_GROUP_RATE = _float('OUTGOING_GROUP_RATE', 20 / 60)
+OUTGOING_CHAT_BURST = _int('OUTGOING_CHAT_BURST', 3)
+OUTGOING_MAX_RETRIES = _int('OUTGOING_MAX_RETRIES', 3)
+
+# Telegram ID администраторов бота через запятую
+BOT_ADMINS = frozenset(int(x) for x in os.getenv('BOT_ADMINS', '').split(',') if x.strip())
+
+# Рассылки: сколько сообщений отправлять одновременно и сколько чатов читать из БД за раз
+BROADCAST_CONCURRENCY = _int('BROADCAST_CONCURRENCY', 10)
+BROADCAST_BATCH_SIZE = _int('BROADCAST_BATCH_SIZE', 100)
+# Как часто подбирать задания рассылки, брошенные упавшим экземпляром, секунды
+BROADCAST_SWEEP_INTERVAL = _int('BROADCAST_SWEEP_INTERVAL', 60)
+
+# Профилировщик (/profile, SIGUSR1): шаг сэмплера в секундах, длительность по умолчанию и предел
+PROFILE_SAMPLE_INTERVAL = _float('PROFILE_SAMPLE_INTERVAL', 0.005)
+PROFILE_DEFAULT_SECONDS = _float('PROFILE_DEFAULT_SECONDS', 30)
+PROFILE_MAX_SECONDS = _float('PROFILE_MAX_SECONDS', 600)
@@ -1,2 +1,2 @@
-from . import db
-from . import alliances, players, guilds
\ No newline at end of file
+from . import db, cache, queries
+from . import alliances, players, guilds, chat_index
\ No newline at end of file
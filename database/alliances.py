@@ -1,80 +1,225 @@
 import asyncpg
-from utils import log
-
-
-async def create_alliance(pool: asyncpg.pool, name: str, tg_id: int):
-    try:
-        async with pool.acquire() as conn:
-            async with conn.transaction():
-                # Получаем ID игрока по его Telegram ID
-                player_id = await conn.fetchval("""
-                    SELECT id FROM players WHERE tg_id = $1
-                """, tg_id)
-
-                # Если игрока нет — регистрируем
-                if not player_id:
-                    player_id = await conn.fetchval("""
-                        INSERT INTO players (tg_id)
-                        VALUES ($1)
-                        RETURNING id
-                    """, tg_id)
-
-                # Создаём альянс
-                await conn.execute("""
-                    INSERT INTO alliances (name, master_id)
-                    VALUES ($1, $2)
-                """, name, player_id)
-    except Exception as e:
-        log.error(f"Ошибка при добавление гильдии {name}: {e}")
-
-
-async def get_alliances_by_master(pool: asyncpg.pool, tg_id: int) -> list[dict]:
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT id, name FROM alliances
-            WHERE master_id = (SELECT id FROM players WHERE tg_id = $1)
-            ORDER BY name
-        """, tg_id)
-
+from redis.asyncio import Redis
+
+from config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+from utils.cache import TTLCache
+from . import cache, chat_index, players, queries
+from .db import Executor, after_commit, on_primary, uncommitted
+
+# Альянсы, по которым недавно проверяли мастера: alliance_id -> строка альянса с master_id.
+# Сбрасывается при любом изменении альянса в этом процессе, в остальных живёт не дольше AUTH_CACHE_TTL.
+# Кэши и индекс чатов меняются только после фиксации записи (db.after_commit),
+# а апдейт с незафиксированной записью читает мимо кэшей (db.uncommitted)
+_master_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+async def create_alliance(pool: Executor, name: str, tg_id: int, redis: Redis | None = None) -> int:
+    """
+    Создаёт альянс, регистрируя мастера при первом обращении, одним запросом.
+    Ошибка запроса не глушится: в транзакции апдейта после неё ничего не выполнить,
+    и обработчик не должен сообщать об успехе
+    :param tg_id: Telegram ID мастера
+    """
+    row = await pool.fetchrow(queries.CREATE_ALLIANCE, name, tg_id)
+    master_id = row["master_id"]
+    await players.remember(pool, tg_id, master_id, redis=redis)
+    await after_commit(pool, lambda: cache.invalidate(redis, cache.master_alliances_key(master_id)))
+    return row["id"]
+
+
+async def get_alliances_page(pool: Executor,
+                             master_id: int,
+                             limit: int,
+                             after: int | None = None,
+                             before: int | None = None,
+                             redis: Redis | None = None) -> dict:
+    """
+    Страница альянсов мастера, отсортированных по названию.
+    Без курсора - первая страница (она же кэшируется), after - следующая за альянсом, before - предыдущая
+    :param pool:
+    :param master_id: ID игрока-мастера
+    :param limit: размер страницы
+    :param after: id последнего альянса текущей страницы
+    :param before: id первого альянса текущей страницы
+    :param redis:
+    :return: {"items": list[dict], "has_prev": bool, "has_next": bool}
+    """
+    if after is None and before is None:
+        if uncommitted(pool):
+            redis = None
+        key = cache.master_alliances_key(master_id)
+        cached = await cache.get(redis, key)
+        if cached is not None and cached["limit"] == limit:
+            return cached["page"]
+
+        rows = await on_primary(pool).fetch(queries.ALLIANCES_FIRST_PAGE, master_id, limit + 1)
+        page = _make_page([dict(row) for row in rows], limit, has_prev=False)
+        await cache.set(redis, key, {"limit": limit, "page": page})
+        return page
+
+    # Лишняя строка сверх limit показывает, есть ли что-то дальше в сторону листания
+    if after is not None:
+        rows = await pool.fetch(queries.ALLIANCES_PAGE_AFTER, master_id, after, limit + 1)
+        page = _make_page([dict(row) for row in rows], limit, has_prev=True)
+    else:
+        rows = await pool.fetch(queries.ALLIANCES_PAGE_BEFORE, master_id, before, limit + 1)
+        items = [dict(row) for row in rows]
+        has_prev = len(items) > limit
+        page = {"items": items[:limit][::-1], "has_prev": has_prev, "has_next": True}
+
+    # Альянс-курсор удалён или страница опустела - возвращаемся к началу списка
+    if not page["items"]:
+        return await get_alliances_page(pool, master_id, limit, redis=redis)
+    return page
+
+
+async def get_master_alliance(pool: Executor, alliance_id: int, master_id: int,
+                              redis: Redis | None = None) -> dict | None:
+    """
+    Возвращает альянс, если пользователь - его мастер.
+    Сначала смотрит в кэш процесса, затем в кэш редиса и только потом в БД
+    :param pool:
+    :param alliance_id: ид альянса
+    :param master_id: ID игрока
+    :param redis:
+    :return: строка альянса или None, если альянса нет или пользователь не мастер
+    """
+    if uncommitted(pool):
+        alliance = await get_alliance_info(pool, alliance_id, redis=redis)
+        return alliance if alliance is not None and alliance["master_id"] == master_id else None
+
+    alliance = _master_cache.get(alliance_id)
+    if alliance is None:
+        alliance = await get_alliance_info(pool, alliance_id, redis=redis)
+        if alliance is None:
+            return None
+        _master_cache.set(alliance_id, alliance)
+    return alliance if alliance["master_id"] == master_id else None
+
+
+async def get_alliance_info(pool: Executor, alliance_id: int, redis: Redis | None = None) -> dict | None:
+    if uncommitted(pool):
+        redis = None
+    key = cache.alliance_key(alliance_id)
+    cached = await cache.get(redis, key)
+    if cached is not None:
+        return cached
+
+    # Кэш общий для всех пользователей и живёт дольше отставания реплики:
+    # строка с реплики могла бы вернуть в него только что изменённое значение
+    row = await on_primary(pool).fetchrow(queries.ALLIANCE_INFO, alliance_id)
+    if not row:
+        return None
+
+    alliance = dict(row)
+    await cache.set(redis, key, alliance)
+    return alliance
+
+
+async def upd_alliance_name(pool: Executor, alliance_id: int, new_name: str, master_id: int | None,
+                            redis: Redis | None = None) -> bool:
+    """
+    Переименовывает альянс, если пользователь его мастер
+    :param master_id: ID игрока, None - незарегистрированный пользователь
+    :return: False, если альянса нет или пользователь не его мастер
+    """
+    if await pool.fetchval(queries.RENAME_ALLIANCE, new_name, alliance_id, master_id) is None:
+        return False
+
+    async def apply() -> None:
+        await _invalidate_alliance(redis, alliance_id, master_id)
+        await chat_index.rename(redis, alliance_id, new_name)
+    await after_commit(pool, apply)
+    return True
+
+
+async def bind_chat_by_master(pool: Executor, alliance_id: int, master_id: int, chat_id: int,
+                              redis: Redis | None = None) -> dict:
+    """
+    Привязывает чат к альянсу, если пользователь его мастер и чат ещё не привязан
+    :return: {"is_master": bool, "success": bool}
+    """
+    row = await pool.fetchrow(queries.BIND_CHAT_BY_MASTER, alliance_id, master_id, chat_id)
+    if row["id"] is not None:
+        async def publish() -> None:
+            await chat_index.bind(redis, alliance_id, row["name"], chat_id)
+        await after_commit(pool, publish)
+    return await _apply_chat_change(pool, redis, alliance_id, master_id, row)
+
+
+async def unbind_chat_by_master(pool: Executor, alliance_id: int, master_id: int,
+                                redis: Redis | None = None) -> dict:
+    """
+    Отвязывает чат от альянса, если пользователь его мастер и чат привязан
+    :return: {"is_master": bool, "success": bool}
+    """
+    row = await pool.fetchrow(queries.UNBIND_CHAT_BY_MASTER, alliance_id, master_id)
+    if row["id"] is not None:
+        await after_commit(pool, lambda: chat_index.unbind(redis, alliance_id))
+    return await _apply_chat_change(pool, redis, alliance_id, master_id, row)
+
+
+async def delete_alliance_by_master(pool: Executor, alliance_id: int, master_id: int, name: str, limit: int,
+                                    redis: Redis | None = None) -> dict:
+    """
+    Удаляет альянс, если пользователь его мастер и название совпало
+    :param limit: размер первой страницы оставшихся альянсов
+    :return: {"is_master": bool, "success": bool, "chat_id": int | None,
+     "page": {"items": list[dict], "has_prev": bool, "has_next": bool}}
+    """
+    row = await pool.fetchrow(queries.DELETE_ALLIANCE_BY_MASTER, alliance_id, master_id, name, limit)
+    remaining = [{"id": id_, "name": name_}
+                 for id_, name_ in zip(row["remaining_ids"], row["remaining_names"])]
+    if row["deleted"]:
+        async def apply() -> None:
+            await _invalidate_alliance(redis, alliance_id, master_id)
+            await chat_index.unbind(redis, alliance_id)
+        await after_commit(pool, apply)
+    return {
+        "is_master": row["is_master"],
+        "success": row["deleted"],
+        "chat_id": row["chat_id"],
+        "page": _make_page(remaining, limit, has_prev=False)
+    }
+
+
+async def get_bound_chats(pool: Executor, after: int, limit: int, master_id: int | None = None) -> list[dict]:
+    """
+    Порция альянсов с привязанным чатом, по возрастанию id
+    :param pool:
+    :param after: id альянса, после которого продолжить (0 - с начала)
+    :param limit: размер порции
+    :param master_id: только альянсы этого мастера (ID игрока), None - все
+    :return: [{"id": int, "name": str, "chat_id": int}]
+    """
+    if master_id is None:
+        rows = await pool.fetch(queries.BOUND_CHATS, after, limit)
+    else:
+        rows = await pool.fetch(queries.BOUND_CHATS_BY_MASTER, master_id, after, limit)
     return [dict(row) for row in rows]
 
 
-async def is_master_of_alliance(pool: asyncpg.Pool, alliance_id: int, tg_id: int) -> bool:
-    async with pool.acquire() as conn:
-        return await conn.fetchval("""
-            SELECT EXISTS(
-                SELECT 1 FROM alliances
-                WHERE id = $1 AND master_id = (SELECT id FROM players WHERE tg_id = $2)
-            )
-        """, alliance_id, tg_id)
-
-
-async def get_alliance_info(pool: asyncpg.Pool, alliance_id: int) -> dict | None:
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT id, name, chat_id FROM alliances WHERE id = $1", alliance_id)
-        return dict(row) if row else None
-
-
-async def get_alliance_name(pool: asyncpg.Pool, alliance_id: int) -> str:
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT name FROM alliances WHERE id = $1", alliance_id)
-        return row["name"] if row else None
-
+def _make_page(items: list[dict], limit: int, has_prev: bool) -> dict:
+    return {"items": items[:limit], "has_prev": has_prev, "has_next": len(items) > limit}
 
-async def upd_alliance_name(pool: asyncpg.Pool, alliance_id: int, new_name: str):
-    async with pool.acquire() as conn:
-        await conn.execute("UPDATE alliances SET name = $1 WHERE id = $2", new_name, alliance_id)
 
+async def _apply_chat_change(pool: Executor, redis: Redis | None, alliance_id: int, master_id: int,
+                             row: asyncpg.Record) -> dict:
+    # Запрос вернул актуальную строку альянса - кладём её в кэш вместо сброса
+    if row["id"] is not None:
+        alliance = {"id": row["id"], "name": row["name"], "chat_id": row["chat_id"],
+                    "master_id": master_id}
 
-async def delete_alliance(pool: asyncpg.Pool, alliance_id: int):
-    async with pool.acquire() as conn:
-        await conn.execute("DELETE FROM alliances WHERE id = $1", alliance_id)
+        async def apply() -> None:
+            _master_cache.set(alliance_id, alliance)
+            await cache.set(redis, cache.alliance_key(alliance_id), alliance)
+        await after_commit(pool, apply)
+    return {"is_master": row["is_master"], "success": row["id"] is not None}
 
 
-async def bind_chat_to_alliance(pool: asyncpg.pool, alliance_id: int, chat_id: int | None):
-    async with pool.acquire() as conn:
-        await conn.execute("""
-            UPDATE alliances
-            SET chat_id = $1
-            WHERE id = $2
-        """, chat_id, alliance_id)
\ No newline at end of file
+async def _invalidate_alliance(redis: Redis | None, alliance_id: int, master_id: int | None = None) -> None:
+    _master_cache.pop(alliance_id)
+    keys = [cache.alliance_key(alliance_id)]
+    if master_id is not None:
+        keys.append(cache.master_alliances_key(master_id))
+    await cache.invalidate(redis, *keys)
@@ -0,0 +1,78 @@
+import json
+from typing import Any
+
+from redis.asyncio import Redis
+
+from config import ALLIANCE_CACHE_TTL
+from utils import log
+
+# Раз в сколько обращений писать статистику кэша в лог
+STATS_LOG_EVERY = 1000
+
+_stats = {"hit": 0, "miss": 0}
+
+
+def alliance_key(alliance_id: int) -> str:
+    return f"cache:alliance:{int(alliance_id)}"
+
+
+def master_alliances_key(master_id: int) -> str:
+    return f"cache:master_page:{int(master_id)}"
+
+
+def player_id_key(tg_id: int) -> str:
+    return f"cache:player_id:{int(tg_id)}"
+
+
+def stats() -> dict:
+    """
+    Счётчики попаданий/промахов кэша с момента запуска
+    """
+    return dict(_stats)
+
+
+def _count(kind: str) -> None:
+    _stats[kind] += 1
+    total = _stats["hit"] + _stats["miss"]
+    if total % STATS_LOG_EVERY == 0:
+        log.info(f"Кэш альянсов: hit={_stats['hit']} miss={_stats['miss']} "
+                 f"({_stats['hit'] / total:.1%} попаданий)")
+
+
+async def get(redis: Redis | None, key: str) -> Any | None:
+    """
+    Достает значение из кэша. Ошибки редиса не роняют запрос - считаем это промахом
+    :param redis:
+    :param key:
+    :return: значение или None при промахе
+    """
+    if redis is None:
+        return None
+    try:
+        raw = await redis.get(key)
+    except Exception as e:
+        log.warning(f"Ошибка чтения кэша {key}: {e}")
+        raw = None
+    if raw is None:
+        _count("miss")
+        return None
+    _count("hit")
+    return json.loads(raw)
+
+
+async def set(redis: Redis | None, key: str, value: Any, ttl: int = ALLIANCE_CACHE_TTL) -> None:
+    if redis is None:
+        return
+    try:
+        await redis.set(key, json.dumps(value, separators=(",", ":")), ex=ttl)
+    except Exception as e:
+        log.warning(f"Ошибка записи кэша {key}: {e}")
+
+
+async def invalidate(redis: Redis | None, *keys: str) -> None:
+    if redis is None or not keys:
+        return
+    try:
+        await redis.delete(*keys)
+    except Exception as e:
+        log.error(f"Ошибка инвалидации кэша {keys}: {e}")
@@ -0,0 +1,167 @@
+"""
+Индекс привязанных чатов в памяти процесса: chat_id -> альянс.
+Групповых апдейтов на порядки больше, чем личных, поэтому альянс чата ищется здесь, без похода в БД.
+Индекс загружается в фоне при запуске, меняется вместе с привязкой/отвязкой/удалением альянса
+и синхронизируется между экземплярами бота через pub/sub Redis
+"""
+import asyncio
+import json
+
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+
+from utils import log
+from . import queries
+from .db import Executor
+
+CHANNEL = "chat_index"
+# Сколько альянсов читать из БД за раз при загрузке
+LOAD_BATCH = 1000
+
+# chat_id -> {"id": int, "name": str, "chat_id": int}
+_by_chat: dict[int, dict] = {}
+# alliance_id -> chat_id, чтобы отвязывать по альянсу
+_by_alliance: dict[int, int] = {}
+# Индекс загружен хотя бы раз. До этого get не отличает непривязанный чат от ещё не загруженного
+_loaded = asyncio.Event()
+
+
+def get(chat_id: int) -> dict | None:
+    """
+    Альянс, к которому привязан чат
+    :param chat_id:
+    :return: {"id": int, "name": str, "chat_id": int} или None
+    """
+    return _by_chat.get(chat_id)
+
+
+def loaded() -> bool:
+    return _loaded.is_set()
+
+
+async def wait_loaded() -> None:
+    """
+    Ждёт первой загрузки индекса после запуска
+    """
+    await _loaded.wait()
+
+
+def size() -> int:
+    return len(_by_chat)
+
+
+async def load(pool: Executor) -> None:
+    """
+    Заново загружает индекс из БД порциями по id альянса
+    """
+    by_chat, by_alliance = {}, {}
+    after = 0
+    while True:
+        rows = await pool.fetch(queries.BOUND_CHATS, after, LOAD_BATCH)
+        if not rows:
+            break
+        for row in rows:
+            by_chat[row["chat_id"]] = {"id": row["id"], "name": row["name"], "chat_id": row["chat_id"]}
+            by_alliance[row["id"]] = row["chat_id"]
+        after = rows[-1]["id"]
+    # Подменяем целиком, чтобы апдейты не видели наполовину загруженный индекс
+    _by_chat.clear()
+    _by_chat.update(by_chat)
+    _by_alliance.clear()
+    _by_alliance.update(by_alliance)
+    _loaded.set()
+
+
+async def bind(redis: Redis | None, alliance_id: int, name: str, chat_id: int) -> None:
+    """
+    Чат привязан к альянсу
+    """
+    _bind(alliance_id, name, chat_id)
+    await _publish(redis, {"op": "bind", "id": alliance_id, "name": name, "chat_id": chat_id})
+
+
+async def unbind(redis: Redis | None, alliance_id: int) -> None:
+    """
+    Чат отвязан от альянса или альянс удалён
+    """
+    _unbind(alliance_id)
+    await _publish(redis, {"op": "unbind", "id": alliance_id})
+
+
+async def rename(redis: Redis | None, alliance_id: int, name: str) -> None:
+    """
+    Альянс переименован
+    """
+    _rename(alliance_id, name)
+    await _publish(redis, {"op": "rename", "id": alliance_id, "name": name})
+
+
+def start(pool: Executor, redis: Redis) -> asyncio.Task:
+    """
+    Запускает задачу, которая загружает индекс и слушает изменения от других экземпляров.
+    Загрузку не ждёт - апдейты, которым нужен индекс, ждут её через wait_loaded
+    :return: задача синхронизации, её нужно отменить при завершении
+    """
+    return asyncio.create_task(_sync(pool, redis))
+
+
+async def _sync(pool: Executor, redis: Redis) -> None:
+    # После обрыва связи с Redis индекс перезагружается из БД - изменения за время обрыва потеряны
+    pubsub: PubSub | None = None
+    try:
+        while True:
+            try:
+                # Сначала подписка, потом загрузка - так изменения во время загрузки не потеряются
+                pubsub = redis.pubsub()
+                await pubsub.subscribe(CHANNEL)
+                await load(pool)
+                log.info(f"Индекс чатов загружен: {size()} чатов")
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        _apply(json.loads(message["data"]))
+            except Exception as e:
+                log.error(f"Синхронизация индекса чатов прервана, перезагрузка через секунду: {e}")
+                if pubsub is not None:
+                    await pubsub.aclose()
+                pubsub = None
+                await asyncio.sleep(1)
+    finally:
+        if pubsub is not None:
+            await pubsub.aclose()
+
+
+def _apply(change: dict) -> None:
+    # Своё же сообщение тоже приходит сюда - операции повторяемы
+    if change["op"] == "bind":
+        _bind(change["id"], change["name"], change["chat_id"])
+    elif change["op"] == "unbind":
+        _unbind(change["id"])
+    elif change["op"] == "rename":
+        _rename(change["id"], change["name"])
+
+
+def _bind(alliance_id: int, name: str, chat_id: int) -> None:
+    _unbind(alliance_id)
+    _by_chat[chat_id] = {"id": alliance_id, "name": name, "chat_id": chat_id}
+    _by_alliance[alliance_id] = chat_id
+
+
+def _unbind(alliance_id: int) -> None:
+    chat_id = _by_alliance.pop(alliance_id, None)
+    if chat_id is not None and _by_chat.get(chat_id, {}).get("id") == alliance_id:
+        del _by_chat[chat_id]
+
+
+def _rename(alliance_id: int, name: str) -> None:
+    chat_id = _by_alliance.get(alliance_id)
+    if chat_id is not None:
+        _by_chat[chat_id] = {**_by_chat[chat_id], "name": name}
+
+
+async def _publish(redis: Redis | None, change: dict) -> None:
+    if redis is None:
+        return
+    try:
+        await redis.publish(CHANNEL, json.dumps(change, separators=(",", ":"), ensure_ascii=False))
+    except Exception as e:
+        log.error(f"Не удалось разослать изменение индекса чатов {change}: {e}")
@@ -1,20 +1,525 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Union
+
 import asyncpg
-from config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
-from utils import log
+from redis.asyncio import Redis
+
+from config import (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME,
+                    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_MAX_INACTIVE_LIFETIME,
+                    DB_STATEMENT_CACHE_SIZE, DB_COMMAND_TIMEOUT,
+                    DB_REPLICAS, DB_REPLICA_MAX_LAG, DB_REPLICA_CHECK_INTERVAL, DB_REPLICA_PIN_SECONDS)
+from utils import log, metrics
+from utils.cache import TTLCache
+from . import queries
+
+# Отставание реплики в секундах. Если реплика применила всё полученное, отставания нет,
+# даже когда последняя транзакция на простаивающем primary была давно.
+# NULL - сервер не реплика (например, в DB_REPLICAS указан сам primary)
+REPLICA_LAG = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+# Сколько ждать ответа реплики при проверке, прежде чем считать её недоступной
+REPLICA_CHECK_TIMEOUT = 5
+# Сколько недавно писавших пользователей помнить в процессе, чтобы не спрашивать Redis.
+# Вытесненный раньше срока проверяется по Redis
+PINNED_USERS_SIZE = 100000
+
+# Ошибки, после которых чтение повторяется на primary: реплика недоступна, перезапускается
+# или отменила запрос из-за конфликта с восстановлением
+_REPLICA_ERRORS = (OSError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError,
+                   asyncpg.SerializationError, asyncpg.OperatorInterventionError)
+
+# Пул и реплики, которые последними открыли connect_db и connect_replicas.
+# Метрики по ним регистрируются один раз при импорте, а не при каждом подключении
+_pool: asyncpg.Pool | None = None
+_replicas: "Replicas | None" = None
+
+metrics.Gauge("db_pool_size", "Открытых подключений в пуле",
+              lambda: _pool.get_size() if _pool is not None else 0)
+metrics.Gauge("db_pool_idle", "Свободных подключений в пуле",
+              lambda: _pool.get_idle_size() if _pool is not None else 0)
+metrics.Gauge("db_replicas_healthy", "Реплик, принимающих чтения",
+              lambda: _replicas.healthy_count() if _replicas is not None else 0)
+
+
+async def prepare_statements(conn: asyncpg.Connection) -> None:
+    """
+    Подготавливает все запросы из реестра на подключении.
+    Вызывается пулом при открытии каждого нового подключения, чтобы первый запрос
+    после рестарта не тратил время на разбор и планирование
+    :param conn: новое подключение
+    """
+    await _prepare(conn, queries.registered())
+
 
-async def connect_db() -> asyncpg.pool:
-    return await asyncpg.create_pool(
+async def prepare_read_statements(conn: asyncpg.Connection) -> None:
+    """
+    То же для подключений к репликам: на них уходят только чтения
+    """
+    await _prepare(conn, queries.reads())
+
+
+async def _prepare(conn: asyncpg.Connection, statements: dict[str, str]) -> None:
+    for name, sql in statements.items():
+        try:
+            # Публичный prepare() не кладёт выражение в кэш подключения,
+            # поэтому используем _prepare(use_cache=True) - так же, как это делает сам asyncpg.
+            # Метод закрытый, поэтому версия asyncpg закреплена в requirements.txt
+            await conn._prepare(sql, use_cache=True)
+        except asyncpg.PostgresError as e:
+            log.warning(f"Не удалось подготовить запрос {name}: {e}")
+
+
+async def connect_db(min_size: int = DB_POOL_MIN_SIZE) -> asyncpg.pool:
+    """
+    Создаёт пул подключений
+    :param min_size: сколько подключений открыть сразу. Остальные до DB_POOL_MIN_SIZE можно открыть
+     в фоне через warm_up, чтобы не задерживать запуск
+    :return: пул
+    """
+    if DB_STATEMENT_CACHE_SIZE < len(queries.registered()):
+        log.warning(f"DB_STATEMENT_CACHE_SIZE={DB_STATEMENT_CACHE_SIZE} меньше числа запросов в реестре "
+                    f"({len(queries.registered())}), часть подготовленных запросов будет вытеснена")
+    pool = await asyncpg.create_pool(
         user=DB_USER,
         password=DB_PASSWORD,
         host=DB_HOST,
         port=DB_PORT,
         database=DB_NAME,
-        min_size=1,
-        max_size=10,
-        command_timeout=60
+        min_size=min_size,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        init=prepare_statements
     )
+    global _pool
+    _pool = pool
+    return pool
+
+async def connect_replicas() -> "Replicas | None":
+    """
+    Создаёт пулы реплик из DB_REPLICAS и запускает проверку их отставания.
+    Пулы открывают подключения по требованию, поэтому недоступная при запуске реплика
+    не мешает старту и начнёт получать чтения, когда поднимется
+    :return: реплики или None, если они не настроены
+    """
+    if not DB_REPLICAS:
+        return None
+    pools = {}
+    for address in DB_REPLICAS:
+        host, _, port = address.partition(":")
+        pools[address] = await asyncpg.create_pool(
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=host,
+            port=int(port) if port else DB_PORT,
+            database=DB_NAME,
+            min_size=0,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            init=prepare_read_statements
+        )
+    global _replicas
+    replicas = _replicas = Replicas(pools)
+    await replicas.check()
+    replicas.start()
+    return replicas
+
+
+async def warm_up(pool: asyncpg.Pool, size: int = DB_POOL_MIN_SIZE) -> None:
+    """
+    Открывает подключения пула заранее (вместе с подготовкой запросов из реестра),
+    чтобы первые апдейты после запуска не ждали подключения к БД
+    :param pool:
+    :param size: сколько подключений должно быть открыто
+    """
+    started = time.perf_counter()
+    conns = []
+    try:
+        conns = await asyncio.gather(*(pool.acquire() for _ in range(size)))
+        await postgres_version(conns[0])
+        log.info(f"Пул прогрет: {len(conns)} подключений за {(time.perf_counter() - started) * 1000:.0f} мс")
+    except Exception as e:
+        log.warning(f"Не удалось прогреть пул подключений: {e}")
+    finally:
+        for conn in conns:
+            await pool.release(conn)
+
+
+def pin_key(user_id: int) -> str:
+    return f"pin:{int(user_id)}"
+
+
+class Replicas:
+    """
+    Пулы реплик для чтения.
+    Фоновая проверка раз в DB_REPLICA_CHECK_INTERVAL замеряет отставание каждой реплики:
+    отставшая больше DB_REPLICA_MAX_LAG или недоступная не получает чтений до следующей удачной проверки.
+    Исправные реплики получают чтения по очереди.
+    Закрепление пользователя за primary после записи хранится в Redis и действует во всех экземплярах бота
+    """
+
+    def __init__(self, pools: dict[str, asyncpg.Pool]):
+        """
+        :param pools: адрес реплики -> пул
+        """
+        self._pools = pools
+        self._healthy: list[asyncpg.Pool] = []
+        self._next = 0
+        # Пользователи, которые недавно писали в БД через этот процесс: их чтения идут на primary без похода в Redis
+        self._pinned = TTLCache(maxsize=PINNED_USERS_SIZE, ttl=DB_REPLICA_PIN_SECONDS)
+        self._task: asyncio.Task | None = None
+
+    def pick(self) -> asyncpg.Pool | None:
+        """
+        Следующая исправная реплика или None, если исправных нет
+        """
+        if not self._healthy:
+            return None
+        self._next = (self._next + 1) % len(self._healthy)
+        return self._healthy[self._next]
+
+    def healthy_count(self) -> int:
+        return len(self._healthy)
+
+    def fail(self, pool: asyncpg.Pool) -> None:
+        """
+        Убирает реплику из чтения до следующей удачной проверки
+        """
+        self._healthy = [item for item in self._healthy if item is not pool]
+
+    async def pin(self, redis: Redis | None, user_id: int | None) -> None:
+        """
+        Направляет чтения пользователя на primary на DB_REPLICA_PIN_SECONDS после его записи
+        """
+        if user_id is None:
+            return
+        self._pinned.set(user_id, True)
+        if redis is None:
+            return
+        try:
+            await redis.set(pin_key(user_id), 1, px=int(DB_REPLICA_PIN_SECONDS * 1000))
+        except Exception as e:
+            log.warning(f"Ошибка закрепления за primary {pin_key(user_id)}: {e}")
+
+    async def is_pinned(self, redis: Redis | None, user_id: int | None) -> bool:
+        """
+        Пользователь недавно писал в БД - в этом или другом экземпляре бота.
+        Если Redis не ответил, считаем закреплённым: лишнее чтение с primary лучше, чем устаревшие данные
+        """
+        if user_id is None:
+            return False
+        if self._pinned.get(user_id, False):
+            return True
+        if redis is None:
+            return False
+        try:
+            return bool(await redis.exists(pin_key(user_id)))
+        except Exception as e:
+            log.warning(f"Ошибка проверки закрепления за primary {pin_key(user_id)}, читаем с primary: {e}")
+            return True
+
+    async def check(self) -> None:
+        """
+        Замеряет отставание всех реплик и обновляет список исправных
+        """
+        lags = await asyncio.gather(*(self._lag(pool) for pool in self._pools.values()), return_exceptions=True)
+        healthy = []
+        for (address, pool), lag in zip(self._pools.items(), lags):
+            if isinstance(lag, BaseException):
+                problem = f"недоступна ({lag!r})"
+            elif lag > DB_REPLICA_MAX_LAG:
+                problem = f"отстаёт на {lag:.1f} с"
+            else:
+                problem = None
+
+            if problem is None:
+                if pool not in self._healthy:
+                    log.info(f"Реплика {address} принимает чтения")
+                healthy.append(pool)
+            elif pool in self._healthy:
+                log.warning(f"Реплика {address} исключена из чтения: {problem}")
+        self._healthy = healthy
+
+    async def _lag(self, pool: asyncpg.Pool) -> float:
+        lag = await asyncio.wait_for(pool.fetchval(REPLICA_LAG), REPLICA_CHECK_TIMEOUT)
+        return float(lag or 0)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._monitor())
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+            try:
+                await self.check()
+            except Exception as e:
+                log.error(f"Ошибка проверки реплик: {e}")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await asyncio.gather(*(pool.close() for pool in self._pools.values()))
+
+
+class UpdateConnection:
+    """
+    Подключение к БД на время одного апдейта.
+    Берётся из пула при первом запросе (апдейты без запросов к БД пул не трогают)
+    и возвращается в пул в конце апдейта. При with_transaction=True все запросы апдейта
+    выполняются в одной транзакции, которая откатывается при ошибке в хендлере.
+    Повторяет методы fetch/fetchrow/fetchval/execute пула, поэтому функции database/*
+    принимают его так же, как пул или подключение.
+    С репликами чтения из реестра идут на реплику, пока апдейт ничего не записал и пользователь
+    не закреплён за primary после недавней записи. Если реплика не ответила, чтение повторяется на primary.
+    Время ожидания подключения и время каждого запроса пишутся в метрики
+    """
+
+    def __init__(self, pool: asyncpg.Pool, with_transaction: bool = False,
+                 replicas: Replicas | None = None, user_id: int | None = None, redis: Redis | None = None):
+        """
+        :param pool: пул primary
+        :param with_transaction: все запросы апдейта в одной транзакции
+        :param replicas: реплики для чтения, None - всё идёт на primary
+        :param user_id: Telegram ID пользователя апдейта, для чтения своих записей
+        :param redis: где хранится закрепление пользователя за primary
+        """
+        self._pool = pool
+        self._with_transaction = with_transaction
+        self._conn: asyncpg.Connection | None = None
+        self._transaction = None
+        self._lock = asyncio.Lock()
+        self._replicas = replicas
+        self._user_id = user_id
+        self._redis = redis
+        # Закреплён ли пользователь за primary: проверяется в Redis один раз за апдейт
+        self._pinned: bool | None = None
+        self._replica: asyncpg.Pool | None = None
+        self._replica_conn: asyncpg.Connection | None = None
+        self._wrote = False
+        self._after_commit: list[Callable[[], Awaitable[Any]]] = []
+        # Запросы, которые сейчас выполняются: пока они идут, подключение не отдаётся (см. suspend)
+        self._busy = 0
+
+    async def connection(self) -> asyncpg.Connection:
+        async with self._lock:
+            if self._conn is None:
+                started = time.perf_counter()
+                conn = await self._pool.acquire()
+                metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+                if self._with_transaction:
+                    self._transaction = conn.transaction()
+                    await self._transaction.start()
+                self._conn = conn
+        return self._conn
+
+    async def _replica_connection(self) -> asyncpg.Connection | None:
+        async with self._lock:
+            if self._replica_conn is None:
+                pool = self._replicas.pick()
+                if pool is None:
+                    metrics.DB_REPLICA_FALLBACKS.inc(reason="unavailable")
+                    return None
+                started = time.perf_counter()
+                try:
+                    conn = await pool.acquire()
+                except _REPLICA_ERRORS as e:
+                    log.warning(f"Не удалось подключиться к реплике, читаем с primary: {e}")
+                    metrics.DB_REPLICA_FALLBACKS.inc(reason="error")
+                    self._replicas.fail(pool)
+                    return None
+                metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+                self._replica, self._replica_conn = pool, conn
+        return self._replica_conn
+
+    async def _release_replica(self) -> None:
+        if self._replica_conn is not None:
+            pool, conn = self._replica, self._replica_conn
+            self._replica, self._replica_conn = None, None
+            await pool.release(conn)
+
+    async def _run(self, method: str, query: str, args: tuple, kwargs: dict, replica: bool = True) -> Any:
+        self._busy += 1
+        try:
+            return await self._execute(method, query, args, kwargs, replica)
+        finally:
+            self._busy -= 1
+
+    async def _execute(self, method: str, query: str, args: tuple, kwargs: dict, replica: bool) -> Any:
+        name = queries.name_of(query)
+        if replica and self._replicas is not None and not self._wrote and queries.is_read(query):
+            if self._pinned is None:
+                self._pinned = await self._replicas.is_pinned(self._redis, self._user_id)
+            replica = not self._pinned
+        else:
+            replica = False
+        if replica:
+            conn = await self._replica_connection()
+            if conn is not None:
+                try:
+                    with metrics.DB_QUERY_SECONDS.time(query=name):
+                        return await getattr(conn, method)(query, *args, **kwargs)
+                except _REPLICA_ERRORS as e:
+                    log.warning(f"Реплика не выполнила {name}, читаем с primary: {e}")
+                    metrics.DB_REPLICA_FALLBACKS.inc(reason="error")
+                    self._replicas.fail(self._replica)
+                    await self._release_replica()
+
+        if not queries.is_read(query):
+            # После записи апдейт читает только с primary, иначе может не увидеть её на реплике
+            self._wrote = True
+        conn = await self.connection()
+        with metrics.DB_QUERY_SECONDS.time(query=name):
+            return await getattr(conn, method)(query, *args, **kwargs)
+
+    async def fetch(self, query: str, *args: Any, **kwargs: Any) -> list[asyncpg.Record]:
+        return await self._run("fetch", query, args, kwargs)
+
+    async def fetchrow(self, query: str, *args: Any, **kwargs: Any) -> asyncpg.Record | None:
+        return await self._run("fetchrow", query, args, kwargs)
+
+    async def fetchval(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        return await self._run("fetchval", query, args, kwargs)
+
+    async def execute(self, query: str, *args: Any, **kwargs: Any) -> str:
+        return await self._run("execute", query, args, kwargs)
+
+    def on_primary(self) -> "Executor":
+        """
+        Куда отправлять чтения, которые должны видеть последние записи всех пользователей
+        :return: то же подключение, но всегда на primary
+        """
+        return _PrimaryConnection(self) if self._replicas is not None else self
+
+    @property
+    def uncommitted(self) -> bool:
+        """
+        Апдейт записал в БД, но транзакция ещё не зафиксирована.
+        Кэши в это время не читаются: в них ещё нет записей апдейта
+        """
+        return self._transaction is not None and self._wrote
+
+    async def after_commit(self, callback: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Выполняет callback после фиксации транзакции апдейта, при откате - не выполняет.
+        Без транзакции записи уже зафиксированы, и callback выполняется сразу
+        :param callback: корутинная функция без аргументов - запись в кэши, публикация изменений
+        """
+        if self._transaction is None:
+            await callback()
+        else:
+            self._after_commit.append(callback)
+
+    async def suspend(self) -> None:
+        """
+        Возвращает подключения в пул на время ожидания, не связанного с БД (очередь запросов к Bot API).
+        Следующий запрос апдейта возьмёт подключение заново.
+        Транзакция, в которой уже есть записи, держит подключение до конца апдейта:
+        отдать его значит зафиксировать записи раньше, чем закончится хендлер.
+        Транзакция только с чтениями завершается, следующий запрос откроет новую
+        """
+        async with self._lock:
+            if self._busy:
+                return
+            await self._release_replica()
+            if self._conn is None or self.uncommitted or self._after_commit:
+                return
+            conn, transaction = self._conn, self._transaction
+            self._conn, self._transaction = None, None
+        try:
+            if transaction is not None:
+                await transaction.commit()
+        finally:
+            await self._pool.release(conn)
+
+    async def release(self, failed: bool = False) -> None:
+        """
+        Завершает транзакцию (если была), возвращает подключение в пул
+        и после фиксации выполняет отложенные действия after_commit
+        :param failed: апдейт завершился ошибкой - откатить транзакцию, отложенные действия отбросить
+        """
+        await self._release_replica()
+        if self._conn is not None:
+            try:
+                if self._transaction is not None:
+                    if failed:
+                        await self._transaction.rollback()
+                    else:
+                        await self._transaction.commit()
+            finally:
+                await self._pool.release(self._conn)
+                self._conn = None
+                self._transaction = None
+                callbacks, self._after_commit = self._after_commit, []
+            if failed:
+                return
+            for callback in callbacks:
+                try:
+                    await callback()
+                except Exception as e:
+                    log.error(f"Ошибка действия после фиксации транзакции: {e}")
+        # Подключение могло вернуться в пул раньше (suspend), записи апдейта от этого не пропадают
+        if not failed and self._wrote and self._replicas is not None:
+            await self._replicas.pin(self._redis, self._user_id)
+
+
+class _PrimaryConnection:
+    """
+    UpdateConnection, у которого все запросы идут на primary (см. UpdateConnection.on_primary)
+    """
+
+    def __init__(self, conn: UpdateConnection):
+        self._conn = conn
+
+    async def fetch(self, query: str, *args: Any, **kwargs: Any) -> list[asyncpg.Record]:
+        return await self._conn._run("fetch", query, args, kwargs, replica=False)
+
+    async def fetchrow(self, query: str, *args: Any, **kwargs: Any) -> asyncpg.Record | None:
+        return await self._conn._run("fetchrow", query, args, kwargs, replica=False)
+
+    async def fetchval(self, query: str, *args: Any, **kwargs: Any) -> Any:
+        return await self._conn._run("fetchval", query, args, kwargs, replica=False)
+
+    async def execute(self, query: str, *args: Any, **kwargs: Any) -> str:
+        return await self._conn._run("execute", query, args, kwargs, replica=False)
+
+
+# Всё, через что database/* выполняет запросы
+Executor = Union[asyncpg.Pool, asyncpg.Connection, UpdateConnection, _PrimaryConnection]
+
+
+def on_primary(pool: Executor) -> Executor:
+    """
+    Исполнитель для чтений, которые должны видеть последние записи всех пользователей.
+    Пул и подключение и так работают с primary
+    """
+    return pool.on_primary() if isinstance(pool, UpdateConnection) else pool
+
+
+async def after_commit(pool: Executor, callback: Callable[[], Awaitable[Any]]) -> None:
+    """
+    Выполняет callback, когда записи, сделанные через pool, зафиксированы.
+    Так кэши и публикации изменений не увидят запись, которую откатит транзакция апдейта
+    """
+    if isinstance(pool, UpdateConnection):
+        await pool.after_commit(callback)
+    else:
+        await callback()
+
+
+def uncommitted(pool: Executor) -> bool:
+    """
+    Через pool сделаны ещё не зафиксированные записи - читать нужно из БД, а не из кэшей
+    """
+    return isinstance(pool, UpdateConnection) and pool.uncommitted
+
 
 async def postgres_version(pool):
-    async with pool.acquire() as conn:
-        version = await conn.fetchval("SELECT version();")
-        log.info(f"PostgreSQL version: {version}")
\ No newline at end of file
+    version = await pool.fetchval("SELECT version();")
+    log.info(f"PostgreSQL version: {version}")
@@ -1,36 +1,19 @@
-import asyncpg
+from redis.asyncio import Redis
 
-from utils import log
+from . import players, queries
+from .db import Executor
 
 
-async def create_guild(pool: asyncpg.pool, name: str, tg_id: int):
-    async with pool.acquire() as conn:
-        async with conn.transaction():
-            # Получаем ID игрока по его Telegram ID
-            player_id = await conn.fetchval("""
-                SELECT id FROM players WHERE tg_id = $1
-            """, tg_id)
+async def create_guild(pool: Executor, name: str, tg_id: int, redis: Redis | None = None) -> int:
+    """
+    Создаёт гильдию, регистрируя мастера при первом обращении, одним запросом
+    :param tg_id: Telegram ID мастера
+    """
+    row = await pool.fetchrow(queries.CREATE_GUILD, name, tg_id)
+    await players.remember(pool, tg_id, row["master_id"], redis=redis)
+    return row["id"]
 
-            # Если игрока нет - регистрируем
-            if not player_id:
-                player_id = await conn.fetchval("""
-                    INSERT INTO players (tg_id)
-                    VALUES ($1)
-                    RETURNING id
-                """, tg_id)
 
-            # Создаём гильдию
-            await conn.execute("""
-                INSERT INTO guilds (name, master_id)
-                VALUES ($1, $2)
-            """, name, player_id)
-
-
-async def get_guilds_user(pool: asyncpg.Pool, tg_id: int) -> list[dict]:
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT id, name FROM guilds
-            WHERE master_id = (SELECT id FROM players WHERE tg_id = $1)
-            ORDER BY name
-        """, tg_id)
-    return [dict(row) for row in rows]
\ No newline at end of file
+async def get_guilds_user(pool: Executor, master_id: int) -> list[dict]:
+    rows = await pool.fetch(queries.GUILDS_BY_MASTER, master_id)
+    return [dict(row) for row in rows]
@@ -0,0 +1,115 @@
+"""
+Миграции схемы БД.
+Миграция - файл database/migrations/NNNN_название.sql, номер задаёт порядок применения.
+Применённые версии записываются в schema_migrations, каждая миграция выполняется в своей транзакции.
+Запуск - python migrate.py рядом с __main__.py
+"""
+import json
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+
+import asyncpg
+
+from utils import log
+from . import queries
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+_FILE_NAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Ключ advisory-лока: два одновременных запуска не применят одну миграцию дважды
+LOCK_KEY = 0x616c6567
+
+# Значения параметров для EXPLAIN по типу. Конкретное значение, а не NULL:
+# с NULL планировщик может свернуть условие и не показать настоящий план
+_SAMPLE_VALUES = {"int2": 1, "int4": 1, "int8": 1, "text": "x", "varchar": "x", "bool": True,
+                  "_int4": [1], "_int8": [1], "timestamptz": datetime(2024, 1, 1, tzinfo=timezone.utc)}
+
+
+def available() -> list[tuple[int, str, Path]]:
+    """
+    Миграции из каталога по возрастанию версии
+    :return: [(версия, название, путь)]
+    """
+    migrations = []
+    for path in MIGRATIONS_DIR.glob("*.sql"):
+        match = _FILE_NAME.match(path.name)
+        if match is None:
+            raise ValueError(f"Имя миграции {path.name} не в формате NNNN_название.sql")
+        migrations.append((int(match.group(1)), match.group(2), path))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Повторяющиеся версии миграций: {versions}")
+    return migrations
+
+
+async def applied(conn: asyncpg.Connection) -> dict[int, str]:
+    """
+    Применённые миграции: версия -> название
+    """
+    await _ensure_table(conn)
+    rows = await conn.fetch("SELECT version, name FROM schema_migrations ORDER BY version")
+    return {row["version"]: row["name"] for row in rows}
+
+
+async def migrate(conn: asyncpg.Connection) -> list[str]:
+    """
+    Применяет все ещё не применённые миграции по порядку
+    :param conn: отдельное подключение (не из пула бота)
+    :return: названия применённых миграций
+    """
+    await _ensure_table(conn)
+    await conn.execute("SELECT pg_advisory_lock($1)", LOCK_KEY)
+    try:
+        done = await applied(conn)
+        names = []
+        for version, name, path in available():
+            if version in done:
+                continue
+            async with conn.transaction():
+                await conn.execute(path.read_text(encoding="utf-8"))
+                await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name)
+            log.info(f"Миграция {version:04} {name} применена")
+            names.append(name)
+        return names
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+
+
+async def check_plans(conn: asyncpg.Connection) -> dict[str, list[str]]:
+    """
+    EXPLAIN всех запросов из реестра с запретом последовательного сканирования.
+    Если Seq Scan остался в плане при enable_seqscan=off, подходящего индекса нет
+    и запрос будет замедляться с ростом таблицы
+    :param conn:
+    :return: имя запроса -> таблицы, которые он читает последовательно. Пусто - всё в порядке
+    """
+    problems = {}
+    async with conn.transaction():
+        await conn.execute("SET LOCAL enable_seqscan = off")
+        for name, sql in queries.registered().items():
+            statement = await conn.prepare(sql)
+            args = [_SAMPLE_VALUES.get(param.name) for param in statement.get_parameters()]
+            plan = json.loads(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args))
+            tables = sorted(set(_seq_scans(plan[0]["Plan"])))
+            if tables:
+                problems[name] = tables
+    return problems
+
+
+def _seq_scans(node: dict) -> list[str]:
+    tables = [node["Relation Name"]] if node["Node Type"] == "Seq Scan" else []
+    for child in node.get("Plans", ()):
+        tables.extend(_seq_scans(child))
+    return tables
+
+
+async def _ensure_table(conn: asyncpg.Connection) -> None:
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version     integer PRIMARY KEY,
+            name        text NOT NULL,
+            applied_at  timestamptz NOT NULL DEFAULT now()
+        )
+    """)
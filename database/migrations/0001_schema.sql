@@ -0,0 +1,18 @@
+-- Исходная схема бота. IF NOT EXISTS - на базах, созданных до миграций, таблицы уже есть
+CREATE TABLE IF NOT EXISTS players (
+    id      serial PRIMARY KEY,
+    tg_id   bigint NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS alliances (
+    id          serial PRIMARY KEY,
+    name        text NOT NULL,
+    master_id   integer NOT NULL REFERENCES players (id),
+    chat_id     bigint
+);
+
+CREATE TABLE IF NOT EXISTS guilds (
+    id          serial PRIMARY KEY,
+    name        text NOT NULL,
+    master_id   integer NOT NULL REFERENCES players (id)
+);
@@ -0,0 +1,14 @@
+-- Индексы под запросы из database/queries.py
+
+-- players.id_by_tg, players.ensure (ON CONFLICT (tg_id)).
+-- Имя совпадает с именем ограничения UNIQUE из 0001, поэтому на новых базах второй индекс не создаётся
+CREATE UNIQUE INDEX IF NOT EXISTS players_tg_id_key ON players (tg_id);
+
+-- Список и страницы альянсов мастера: фильтр по master_id и keyset по (name, id)
+CREATE INDEX IF NOT EXISTS alliances_master_name_id_idx ON alliances (master_id, name, id);
+
+-- Список гильдий мастера
+CREATE INDEX IF NOT EXISTS guilds_master_name_id_idx ON guilds (master_id, name, id);
+
+-- Привязанные чаты (рассылки, индекс чатов): keyset по id только среди альянсов с чатом
+CREATE INDEX IF NOT EXISTS alliances_bound_chat_idx ON alliances (id) WHERE chat_id IS NOT NULL;
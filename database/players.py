@@ -1,6 +1,64 @@
-import asyncpg
+from redis.asyncio import Redis
 
+from config import PLAYER_ID_CACHE_SIZE, PLAYER_ID_REDIS_TTL
+from utils import log
+from utils.cache import TTLCache
+from . import cache, queries
+from .db import Executor, after_commit
 
-async def get_player_id(pool: asyncpg.Pool, tg_id: int) -> int | None:
-    async with pool.acquire() as conn:
-        return await conn.fetchval("SELECT id FROM players WHERE tg_id = $1", tg_id)
\ No newline at end of file
+# tg_id -> players.id. id игрока не меняется после создания, поэтому записи живут до вытеснения.
+# Отсутствие игрока не кэшируется - он может зарегистрироваться в другом экземпляре бота
+_ids = TTLCache(maxsize=PLAYER_ID_CACHE_SIZE)
+
+
+async def get_player_id(pool: Executor, tg_id: int, redis: Redis | None = None) -> int | None:
+    """
+    ID игрока по Telegram ID: кэш процесса, затем редис, затем БД
+    :param pool:
+    :param tg_id: Telegram ID игрока
+    :param redis: второй уровень кэша, None - без него
+    :return: ID игрока или None, если игрок не зарегистрирован
+    """
+    player_id = _ids.get(tg_id)
+    if player_id is not None:
+        return player_id
+
+    player_id = await _get_redis(redis, tg_id)
+    if player_id is None:
+        player_id = await pool.fetchval(queries.PLAYER_ID, tg_id)
+        if player_id is None:
+            return None
+        await _set_redis(redis, tg_id, player_id)
+    _ids.set(tg_id, player_id)
+    return player_id
+
+
+async def remember(pool: Executor, tg_id: int, player_id: int, redis: Redis | None = None) -> None:
+    """
+    Кладёт id игрока, записанного через pool, в кэши после фиксации записи:
+    откат апдейта не должен оставить в кэше id несуществующего игрока
+    """
+    async def apply() -> None:
+        _ids.set(tg_id, player_id)
+        await _set_redis(redis, tg_id, player_id)
+    await after_commit(pool, apply)
+
+
+async def _get_redis(redis: Redis | None, tg_id: int) -> int | None:
+    if redis is None or not PLAYER_ID_REDIS_TTL:
+        return None
+    try:
+        value = await redis.get(cache.player_id_key(tg_id))
+    except Exception as e:
+        log.warning(f"Ошибка чтения id игрока {tg_id} из редиса: {e}")
+        return None
+    return int(value) if value is not None else None
+
+
+async def _set_redis(redis: Redis | None, tg_id: int, player_id: int) -> None:
+    if redis is None or not PLAYER_ID_REDIS_TTL:
+        return
+    try:
+        await redis.set(cache.player_id_key(tg_id), player_id, ex=PLAYER_ID_REDIS_TTL)
+    except Exception as e:
+        log.warning(f"Ошибка записи id игрока {tg_id} в редис: {e}")
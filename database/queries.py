@@ -0,0 +1,212 @@
+"""
+Реестр SQL-запросов бота.
+Все запросы хранятся здесь под именем и в каноничном виде (без лишних пробелов и переносов),
+чтобы текст запроса был одинаковым при каждом вызове и попадал в кэш подготовленных выражений asyncpg.
+При открытии нового подключения пул заранее подготавливает все запросы из реестра (см. db.connect_db).
+Запросы, которые начинаются с SELECT, считаются чтением и при настроенных репликах уходят на них (см. db.Replicas).
+Пишущий запрос не должен начинаться с SELECT - для этого есть WITH ... UPDATE/DELETE
+"""
+
+_registry: dict[str, str] = {}
+_names: dict[str, str] = {}
+_reads: set[str] = set()
+
+
+def register(name: str, sql: str) -> str:
+    """
+    Регистрирует запрос в реестре
+    :param name: уникальное имя запроса
+    :param sql: текст запроса
+    :return: каноничный текст запроса
+    """
+    if name in _registry:
+        raise ValueError(f"Запрос {name} уже зарегистрирован")
+    canonical = " ".join(sql.split())
+    _registry[name] = canonical
+    _names[canonical] = name
+    if canonical.upper().startswith("SELECT "):
+        _reads.add(canonical)
+    return canonical
+
+
+def registered() -> dict[str, str]:
+    """
+    Все зарегистрированные запросы: имя -> текст
+    """
+    return dict(_registry)
+
+
+def reads() -> dict[str, str]:
+    """
+    Запросы-чтения из реестра: имя -> текст
+    """
+    return {name: sql for name, sql in _registry.items() if sql in _reads}
+
+
+def is_read(sql: str) -> bool:
+    """
+    Запрос из реестра, который только читает. Запросы не из реестра считаются записью
+    """
+    return sql in _reads
+
+
+def name_of(sql: str) -> str:
+    """
+    Имя запроса по его тексту, для метрик и логов. Запросы не из реестра - "other"
+    """
+    return _names.get(sql, "other")
+
+
+# =====[players]=====
+PLAYER_ID = register("players.id_by_tg", """
+    SELECT id FROM players WHERE tg_id = $1
+""")
+
+# =====[alliances]=====
+# Мастер везде передаётся внутренним id игрока (players.id), его даёт кэш players.get_player_id.
+# Создание регистрирует игрока и добавляет альянс одним запросом, поэтому принимает Telegram ID.
+# master_id возвращается для кэша id игрока. DO UPDATE вместо DO NOTHING, чтобы RETURNING вернул
+# и уже существующего игрока
+CREATE_ALLIANCE = register("alliances.create", """
+    WITH player AS (
+        INSERT INTO players (tg_id)
+        VALUES ($2)
+        ON CONFLICT (tg_id) DO UPDATE SET tg_id = EXCLUDED.tg_id
+        RETURNING id
+    )
+    INSERT INTO alliances (name, master_id)
+    SELECT $1, id FROM player
+    RETURNING id, master_id
+""")
+
+# Постраничный вывод альянсов мастера: keyset по (name, id).
+# Курсор - id крайнего альянса страницы, его ключ сортировки достаётся по первичному ключу
+ALLIANCES_FIRST_PAGE = register("alliances.first_page", """
+    SELECT id, name FROM alliances
+    WHERE master_id = $1
+    ORDER BY name, id
+    LIMIT $2
+""")
+
+ALLIANCES_PAGE_AFTER = register("alliances.page_after", """
+    SELECT a.id, a.name FROM alliances a
+    WHERE a.master_id = $1
+      AND (a.name, a.id) > (SELECT c.name, c.id FROM alliances c WHERE c.id = $2)
+    ORDER BY a.name, a.id
+    LIMIT $3
+""")
+
+ALLIANCES_PAGE_BEFORE = register("alliances.page_before", """
+    SELECT a.id, a.name FROM alliances a
+    WHERE a.master_id = $1
+      AND (a.name, a.id) < (SELECT c.name, c.id FROM alliances c WHERE c.id = $2)
+    ORDER BY a.name DESC, a.id DESC
+    LIMIT $3
+""")
+
+ALLIANCE_INFO = register("alliances.info", """
+    SELECT id, name, chat_id, master_id
+    FROM alliances
+    WHERE id = $1
+""")
+
+# Переименование с проверкой мастера. Возвращаем мастера, чтобы сбросить кэш его списка альянсов
+RENAME_ALLIANCE = register("alliances.rename", """
+    UPDATE alliances
+    SET name = $1
+    WHERE id = $2 AND master_id = $3
+    RETURNING master_id
+""")
+
+# Привязка/отвязка чата и удаление с проверкой мастера одним запросом.
+# is_master отличает чужой альянс от альянса в неподходящем состоянии
+BIND_CHAT_BY_MASTER = register("alliances.bind_chat_by_master", """
+    WITH target AS (
+        SELECT id FROM alliances
+        WHERE id = $1 AND master_id = $2
+    ), updated AS (
+        UPDATE alliances
+        SET chat_id = $3
+        WHERE id IN (SELECT id FROM target) AND chat_id IS NULL
+        RETURNING id, name, chat_id
+    )
+    SELECT EXISTS(SELECT 1 FROM target) AS is_master, u.id, u.name, u.chat_id
+    FROM (SELECT 1) AS one
+    LEFT JOIN updated u ON TRUE
+""")
+
+UNBIND_CHAT_BY_MASTER = register("alliances.unbind_chat_by_master", """
+    WITH target AS (
+        SELECT id FROM alliances
+        WHERE id = $1 AND master_id = $2
+    ), updated AS (
+        UPDATE alliances
+        SET chat_id = NULL
+        WHERE id IN (SELECT id FROM target) AND chat_id IS NOT NULL
+        RETURNING id, name, chat_id
+    )
+    SELECT EXISTS(SELECT 1 FROM target) AS is_master, u.id, u.name, u.chat_id
+    FROM (SELECT 1) AS one
+    LEFT JOIN updated u ON TRUE
+""")
+
+# Удаляет альянс, если название совпало, и сразу возвращает первую страницу оставшихся альянсов мастера
+# с одной лишней строкой - по ней видно, есть ли следующая страница.
+# Удалённая строка ещё видна в снимке запроса, поэтому исключаем её явно
+DELETE_ALLIANCE_BY_MASTER = register("alliances.delete_by_master", """
+    WITH target AS (
+        SELECT id, name, chat_id FROM alliances
+        WHERE id = $1 AND master_id = $2
+    ), deleted AS (
+        DELETE FROM alliances
+        WHERE id IN (SELECT id FROM target WHERE name = $3)
+        RETURNING id
+    ), remaining AS (
+        SELECT a.id, a.name FROM alliances a
+        WHERE a.master_id = $2 AND EXISTS(SELECT 1 FROM target)
+          AND a.id NOT IN (SELECT id FROM deleted)
+        ORDER BY a.name, a.id
+        LIMIT $4 + 1
+    )
+    SELECT EXISTS(SELECT 1 FROM target) AS is_master,
+           EXISTS(SELECT 1 FROM deleted) AS deleted,
+           (SELECT name FROM target) AS name,
+           (SELECT chat_id FROM target) AS chat_id,
+           ARRAY(SELECT id FROM remaining ORDER BY name, id) AS remaining_ids,
+           ARRAY(SELECT name FROM remaining ORDER BY name, id) AS remaining_names
+""")
+
+# Чаты для рассылки: keyset по id альянса, он же курсор для продолжения после сбоя
+BOUND_CHATS = register("alliances.bound_chats", """
+    SELECT id, name, chat_id FROM alliances
+    WHERE chat_id IS NOT NULL AND id > $1
+    ORDER BY id
+    LIMIT $2
+""")
+
+BOUND_CHATS_BY_MASTER = register("alliances.bound_chats_by_master", """
+    SELECT id, name, chat_id FROM alliances
+    WHERE master_id = $1 AND chat_id IS NOT NULL AND id > $2
+    ORDER BY id
+    LIMIT $3
+""")
+
+# =====[guilds]=====
+CREATE_GUILD = register("guilds.create", """
+    WITH player AS (
+        INSERT INTO players (tg_id)
+        VALUES ($2)
+        ON CONFLICT (tg_id) DO UPDATE SET tg_id = EXCLUDED.tg_id
+        RETURNING id
+    )
+    INSERT INTO guilds (name, master_id)
+    SELECT $1, id FROM player
+    RETURNING id, master_id
+""")
+
+GUILDS_BY_MASTER = register("guilds.by_master", """
+    SELECT id, name FROM guilds
+    WHERE master_id = $1
+    ORDER BY name
+""")
+
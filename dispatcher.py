@@ -0,0 +1,103 @@
+import asyncio
+from typing import Any
+
+import asyncpg
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from redis.asyncio import Redis
+
+from config import (FSM_STATE_TTL, FSM_DATA_TTL, UPDATES_MAX_IN_FLIGHT, DB_UPDATE_TRANSACTION,
+                    THROTTLE_ENABLED, THROTTLE_RATE, THROTTLE_BURST, THROTTLE_LIMITS)
+from database.db import Replicas
+from features import setup_routers, state_ttls
+from utils import profiler
+import redis_
+import middleware
+
+
+class BotDispatcher(Dispatcher):
+    """
+    Диспетчер, который знает, сколько апдейтов сейчас в обработке.
+    Через feed_update проходят апдейты и поллинга, и вебхука, поэтому считаем здесь
+    """
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            return await super().feed_update(bot, update, **kwargs)
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self._idle.set()
+            profiler.update_finished()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """
+        Ждёт, пока не останется апдейтов в обработке
+        :param timeout: сколько ждать, секунды
+        :return: True - все апдейты обработаны, False - вышло время
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+def create_dispatcher(pool: asyncpg.Pool, redis: Redis, fsm_redis: Redis,
+                      throttling: bool = THROTTLE_ENABLED, replicas: Replicas | None = None) -> BotDispatcher:
+    """
+    Собирает диспетчер бота: хранилище FSM, изоляцию апдейтов, мидлвари и роутеры
+    :param pool: пул подключений к БД
+    :param redis: клиент редиса для кэшей и заявок
+    :param fsm_redis: клиент редиса для FSM (decode_responses=False)
+    :param throttling: ограничивать частоту апдейтов
+    :param replicas: реплики БД для чтения, None - всё читается с primary
+    :return: диспетчер
+    """
+    storage = redis_.storage.CompactRedisStorage(redis=fsm_redis,
+                                                 state_ttl=FSM_STATE_TTL,
+                                                 data_ttl=FSM_DATA_TTL,
+                                                 state_ttls=state_ttls())
+    # Апдейты разных пользователей обрабатываются параллельно, одного пользователя - по порядку
+    dp = BotDispatcher(storage=storage,
+                       events_isolation=middleware.OrderedEventIsolation(max_in_flight=UPDATES_MAX_IN_FLIGHT))
+    dp["pool"] = pool
+    # DBMiddleware подменяет "pool" подключением апдейта, а фоновым задачам нужен сам пул.
+    # Данные диспетчера попадают в хендлеры и при поллинге, и при вебхуке
+    dp["broadcast_pool"] = pool
+    dp["redis"] = redis
+
+    # Регаем мидлваеры
+    throttler = redis_.throttle.Throttler(redis)
+    if throttling:
+        # После FSMContextMiddleware: проверка ждёт Redis, и только под локом изоляции апдейты пользователя
+        # не обгонят друг друга. До DBMiddleware - лишние апдейты не доходят до фильтров и пула
+        dp.update.outer_middleware(middleware.ThrottlingMiddleware(throttler, "bot", THROTTLE_RATE, THROTTLE_BURST))
+    dp.update.outer_middleware(middleware.DBMiddleware(pool=pool, with_transaction=DB_UPDATE_TRANSACTION,
+                                                      replicas=replicas))
+    dp.update.outer_middleware(middleware.ChatAllianceMiddleware())
+    # Внутренние мидлвари диспетчера применяются и к хендлерам вложенных роутеров
+    dp.message.middleware(middleware.MetricsMiddleware())
+    dp.callback_query.middleware(middleware.MetricsMiddleware())
+
+    # Регам роуторы
+    routers = setup_routers()
+    dp.include_router(routers)
+    if throttling:
+        # Внешние мидлвари роутера срабатывают до его фильтров: фильтры, которые что-то забирают
+        # (HaveRequestByUser), не теряют это на отклонённом апдейте
+        for router in routers.chain_tail:
+            if router.name in THROTTLE_LIMITS:
+                rate, burst = THROTTLE_LIMITS[router.name]
+                router.message.outer_middleware(middleware.ThrottlingMiddleware(throttler, router.name, rate, burst))
+                router.callback_query.outer_middleware(
+                    middleware.ThrottlingMiddleware(throttler, router.name, rate, burst))
+    return dp
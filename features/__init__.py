@@ -1 +1 @@
-from .init_routers import setup_routers
\ No newline at end of file
+from .init_routers import setup_routers, state_ttls
\ No newline at end of file
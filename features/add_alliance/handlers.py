@@ -1,11 +1,14 @@
 import asyncpg
-from aiogram import Router, F
+from aiogram import F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import Message, CallbackQuery
+from redis.asyncio import Redis
 
 from database import alliances
+from features.callbacks import CreateAlliance
+from utils.callback import CallbackRouter
 from .keyboards import (create_alliance_keyboard)
 
 
@@ -14,14 +17,13 @@ class AddAlliance(StatesGroup):
     confirm_create_alliance = State()
 
 
-router = Router()
+router = CallbackRouter(name="add_alliance")
 
 
 @router.message(F.text,
                 Command('create_alliance'))
 async def cmd_add_alliance(msg: Message, state: FSMContext):
-    await state.update_data(name=None)
-    await state.update_data(user_id=msg.from_user.id)
+    await state.update_data(name=None, user_id=msg.from_user.id)
     text = f"Укажите название альянса в новом сообщении"
     await msg.answer(text=text)
     await state.set_state(AddAlliance.input_name)
@@ -40,11 +42,12 @@ async def input_name_alliance(msg: Message, state: FSMContext):
                      reply_markup=keyboard)
 
 
-@router.callback_query(F.data == "create_alliance",
+@router.callback_query(CreateAlliance.filter(),
                        AddAlliance.input_name)
 async def create_alliance(call: CallbackQuery,
                           state: FSMContext,
-                          pool: asyncpg.pool):
+                          pool: asyncpg.pool,
+                          redis: Redis):
     data = await state.get_data()
     name = data["name"]
     if not name:
@@ -53,7 +56,8 @@ async def create_alliance(call: CallbackQuery,
     # Добавить обработчик добавления в БД альянса
     await alliances.create_alliance(name=name,
                                    tg_id=call.from_user.id,
-                                   pool=pool)
+                                   pool=pool,
+                                   redis=redis)
     await call.message.answer(text=f"Альянс {name} успешно создан")
     await state.clear()
     await call.answer()
@@ -1,9 +1,13 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from features.callbacks import CreateAlliance
+from utils.markup import intern
+
+_CREATE_ALLIANCE_KEYBOARD = intern(InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Создать", callback_data=CreateAlliance().pack())]
+]
+))
+
 
 def create_alliance_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Создать", callback_data="create_alliance")]
-    ]
-    )
-    return keyboard
\ No newline at end of file
+    return _CREATE_ALLIANCE_KEYBOARD
\ No newline at end of file
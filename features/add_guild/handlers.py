@@ -1,19 +1,23 @@
-from aiogram import Router, F
+from aiogram import F
 from aiogram.filters import Command
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
 import asyncpg
+from redis.asyncio import Redis
 
+from features.callbacks import Confirm
 from utils import log
+from utils.callback import CallbackRouter
 
 from .states import AddGuildStates
 from .keyboards import create_guild_keyboard
 from .logic import process_create_guild
 
 from database.guilds import get_guilds_user
+from database.players import get_player_id
 
 
-router = Router()
+router = CallbackRouter(name="add_guild")
 
 @router.message(Command("create_guild"))
 async def create_guild(msg: Message,
@@ -37,11 +41,12 @@ async def first_input_name(msg: Message,
                      reply_markup=keyboard)
 
 
-@router.callback_query(F.data == "confirm",
+@router.callback_query(Confirm.filter(),
                        AddGuildStates.first_input_name)
 async def create_new_guild(call: CallbackQuery,
                            state:FSMContext,
-                           pool: asyncpg.Pool):
+                           pool: asyncpg.Pool,
+                           redis: Redis):
     data = await state.get_data()
     name = data.get("name_guild")
     user_id = call.from_user.id
@@ -51,14 +56,15 @@ async def create_new_guild(call: CallbackQuery,
         return
     await process_create_guild(pool=pool,
                                name=name,
-                               user_id=user_id)
+                               user_id=user_id,
+                               redis=redis)
     await call.message.edit_text(f"Гильдия {name} успешно создана")
     await call.answer()
 
 @router.message(Command("settings_guild"))
-async def settings_guilds(msg: Message, pool: asyncpg.Pool):
-    guilds = await get_guilds_user(pool=pool,
-                                   tg_id=msg.from_user.id)
+async def settings_guilds(msg: Message, pool: asyncpg.Pool, redis: Redis):
+    master_id = await get_player_id(pool, tg_id=msg.from_user.id, redis=redis)
+    guilds = await get_guilds_user(pool=pool, master_id=master_id) if master_id is not None else []
     text = ("Ваши гильдии:\n"
             "\n")
     for guild in guilds:
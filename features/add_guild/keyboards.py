@@ -1,9 +1,13 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from features.callbacks import Confirm
+from utils.markup import intern
+
+_CREATE_GUILD_KEYBOARD = intern(InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Создать", callback_data=Confirm().pack())]
+]
+))
+
 
 def create_guild_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Создать", callback_data="confirm")]
-    ]
-    )
-    return keyboard
\ No newline at end of file
+    return _CREATE_GUILD_KEYBOARD
\ No newline at end of file
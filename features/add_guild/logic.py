@@ -1,14 +1,18 @@
 import asyncpg
+from redis.asyncio import Redis
+
 from database import guilds
 from utils import log
 
 async def process_create_guild(pool: asyncpg.Pool,
                            name: str,
-                           user_id: int) -> bool:
+                           user_id: int,
+                           redis: Redis | None = None) -> bool:
     try:
         await guilds.create_guild(pool=pool,
                                   name=name,
-                                  tg_id=user_id)
+                                  tg_id=user_id,
+                                  redis=redis)
         return True
     except Exception as e:
         log.error(f"Ошибка при создании новой гильдии: {e}")
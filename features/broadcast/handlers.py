@@ -0,0 +1,99 @@
+import asyncpg
+from aiogram import F
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message, CallbackQuery
+from redis.asyncio import Redis
+
+from features.callbacks import BroadcastConfirm, BroadcastCancel
+from features.filters.chat import TypeChat
+from features.filters.user import IsBotAdmin
+from utils.callback import CallbackRouter
+from .keyboards import confirm_broadcast_keyboard
+from .logic import start_broadcast
+from .states import BroadcastStates
+
+router = CallbackRouter(name="broadcast")
+
+
+@router.message(Command("broadcast"),
+                TypeChat("private"))
+async def cmd_broadcast(msg: Message, state: FSMContext) -> None:
+    """
+    Рассылка в чаты альянсов мастера
+    :param msg:
+    :param state:
+    :return:
+    """
+    await state.set_data({"scope": "master"})
+    await state.set_state(BroadcastStates.input_text)
+    await msg.answer(text="Введите текст объявления для чатов ваших альянсов:")
+
+
+@router.message(Command("broadcast_all"),
+                TypeChat("private"),
+                IsBotAdmin())
+async def cmd_broadcast_all(msg: Message, state: FSMContext) -> None:
+    """
+    Рассылка во все привязанные чаты, только для администраторов бота
+    :param msg:
+    :param state:
+    :return:
+    """
+    await state.set_data({"scope": "all"})
+    await state.set_state(BroadcastStates.input_text)
+    await msg.answer(text="Введите текст объявления для всех привязанных чатов:")
+
+
+@router.message(F.text,
+                BroadcastStates.input_text)
+async def input_broadcast_text(msg: Message, state: FSMContext) -> None:
+    """
+    Ввод текста объявления
+    :param msg:
+    :param state:
+    :return:
+    """
+    await state.update_data(text=msg.text)
+    await state.set_state(BroadcastStates.confirm)
+    await msg.answer(text=f"Текст объявления:\n\n{msg.text}\n\nОтправить?",
+                     parse_mode=None,
+                     reply_markup=confirm_broadcast_keyboard())
+
+
+@router.callback_query(BroadcastConfirm.filter(),
+                       BroadcastStates.confirm)
+async def confirm_broadcast(call: CallbackQuery, state: FSMContext, redis: Redis,
+                            broadcast_pool: asyncpg.Pool) -> None:
+    """
+    Запуск рассылки
+    :param call:
+    :param state:
+    :param redis:
+    :param broadcast_pool: пул из данных диспетчера - подключение апдейта закроется раньше, чем закончится рассылка
+    :return:
+    """
+    data = await state.get_data()
+    await state.clear()
+    await start_broadcast(bot=call.bot,
+                          pool=broadcast_pool,
+                          redis=redis,
+                          owner_id=call.from_user.id,
+                          scope=data["scope"],
+                          text=data["text"])
+    await call.message.edit_text(text="Рассылка запущена. Когда она закончится, придёт отчёт.")
+    await call.answer()
+
+
+@router.callback_query(BroadcastCancel.filter(),
+                       StateFilter(BroadcastStates.input_text, BroadcastStates.confirm))
+async def cancel_broadcast(call: CallbackQuery, state: FSMContext) -> None:
+    """
+    Отмена рассылки
+    :param call:
+    :param state:
+    :return:
+    """
+    await state.clear()
+    await call.message.edit_text(text="Рассылка отменена")
+    await call.answer()
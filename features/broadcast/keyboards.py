@@ -0,0 +1,14 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from features.callbacks import BroadcastConfirm, BroadcastCancel
+from utils.markup import intern
+
+_CONFIRM_BROADCAST_KEYBOARD = intern(InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Отправить", callback_data=BroadcastConfirm().pack())],
+    [InlineKeyboardButton(text="Отменить", callback_data=BroadcastCancel().pack())]
+]
+))
+
+
+def confirm_broadcast_keyboard():
+    return _CONFIRM_BROADCAST_KEYBOARD
@@ -0,0 +1,178 @@
+import asyncio
+import uuid
+
+import asyncpg
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from redis.asyncio import Redis
+
+from config import BROADCAST_CONCURRENCY, BROADCAST_BATCH_SIZE, BROADCAST_SWEEP_INTERVAL
+from database import alliances, players
+from outgoing import background
+from redis_ import broadcasts
+from utils import log, metrics
+
+# Аренда задания продлевается после каждой порции, поэтому она с запасом длиннее отправки одной порции
+LEASE_TTL = 5 * 60
+
+# Метка экземпляра бота для аренды заданий
+_instance = uuid.uuid4().hex[:8]
+# Задания, которые выполняет этот экземпляр: id -> задача
+_running: dict[str, asyncio.Task] = {}
+# Периодический подбор заданий, аренда которых освободилась
+_sweeper: asyncio.Task | None = None
+
+
+async def start_broadcast(bot: Bot, pool: asyncpg.Pool, redis: Redis,
+                          owner_id: int, scope: str, text: str) -> str:
+    """
+    Создаёт задание рассылки и запускает его в фоне
+    :param bot:
+    :param pool: пул БД (не подключение апдейта - рассылка переживает апдейт)
+    :param redis:
+    :param owner_id: Telegram ID автора
+    :param scope: "master" - чаты альянсов автора, "all" - все привязанные чаты
+    :param text: текст объявления
+    :return: id задания
+    """
+    job_id = await broadcasts.create(redis, owner_id=owner_id, scope=scope, text=text)
+    _spawn(bot, pool, redis, job_id)
+    return job_id
+
+
+async def resume_broadcasts(bot: Bot, pool: asyncpg.Pool, redis: Redis) -> None:
+    """
+    Продолжает незавершённые задания после перезапуска и раз в BROADCAST_SWEEP_INTERVAL
+    подбирает задания, аренда которых освободилась (экземпляр, который их выполнял, упал).
+    Задания, которые ещё выполняет другой экземпляр, пропускаются - их аренда занята
+    """
+    global _sweeper
+    await _resume(bot, pool, redis)
+    if _sweeper is None:
+        _sweeper = asyncio.create_task(_sweep(bot, pool, redis))
+
+
+async def _resume(bot: Bot, pool: asyncpg.Pool, redis: Redis) -> None:
+    for job_id in await broadcasts.active(redis):
+        if job_id not in _running:
+            _spawn(bot, pool, redis, job_id)
+
+
+async def _sweep(bot: Bot, pool: asyncpg.Pool, redis: Redis) -> None:
+    while True:
+        await asyncio.sleep(BROADCAST_SWEEP_INTERVAL)
+        try:
+            await _resume(bot, pool, redis)
+        except Exception as e:
+            log.error(f"Ошибка подбора заданий рассылки: {e}")
+
+
+async def stop_broadcasts() -> None:
+    """
+    Останавливает рассылки этого экземпляра. Прогресс уже сохранён, после запуска они продолжатся
+    """
+    global _sweeper
+    tasks = list(_running.values())
+    if _sweeper is not None:
+        tasks.append(_sweeper)
+        _sweeper = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _spawn(bot: Bot, pool: asyncpg.Pool, redis: Redis, job_id: str) -> None:
+    task = asyncio.create_task(_run(bot, pool, redis, job_id))
+    _running[job_id] = task
+    task.add_done_callback(lambda done: _on_done(job_id, done))
+
+
+def _on_done(job_id: str, task: asyncio.Task) -> None:
+    _running.pop(job_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        log.error(f"Рассылка {job_id} завершилась ошибкой: {task.exception()!r}")
+
+
+async def _run(bot: Bot, pool: asyncpg.Pool, redis: Redis, job_id: str) -> None:
+    if not await broadcasts.acquire(redis, job_id, owner=_instance, ttl=LEASE_TTL):
+        return
+    job = None
+    try:
+        job = await broadcasts.get(redis, job_id)
+        if job is None:
+            await broadcasts.finish(redis, job_id, status="failed")
+            return
+        if job.get("status", "active") != "active":
+            # Задание завершили между чтением списка активных и взятием аренды
+            await broadcasts.release(redis, job_id)
+            return
+        await _deliver(bot, pool, redis, job_id, job)
+    except asyncio.CancelledError:
+        # Остановка экземпляра: аренду отпускаем, чтобы после перезапуска задание сразу продолжилось,
+        # а не ждало истечения LEASE_TTL
+        try:
+            await asyncio.shield(broadcasts.release(redis, job_id))
+        except Exception as e:
+            log.error(f"Рассылка {job_id}: не удалось освободить аренду: {e!r}")
+        raise
+    except Exception as e:
+        log.error(f"Рассылка {job_id} прервана ошибкой: {e!r}")
+        try:
+            await broadcasts.finish(redis, job_id, status="failed")
+            if job is not None:
+                await bot.send_message(chat_id=job["owner_id"], text="Рассылка прервана из-за ошибки.")
+        except Exception as report_error:
+            log.error(f"Рассылка {job_id}: не удалось отметить ошибку: {report_error!r}")
+
+
+async def _deliver(bot: Bot, pool: asyncpg.Pool, redis: Redis, job_id: str, job: dict) -> None:
+    cursor, sent, failed = job["cursor"], job["sent"], job["failed"]
+    master_id = None
+    if job["scope"] == "master":
+        master_id = await players.get_player_id(pool, tg_id=job["owner_id"], redis=redis)
+    # Автор, который ни разу не создавал альянс, не зарегистрирован как игрок - отправлять некуда
+    has_targets = job["scope"] == "all" or master_id is not None
+    if cursor:
+        log.info(f"Рассылка {job_id}: продолжаем с альянса {cursor}, доставлено {sent}, ошибок {failed}")
+
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def send(chat_id: int) -> bool:
+        async with semaphore:
+            try:
+                # Текст пользователя отправляем как есть, без разметки
+                await bot.send_message(chat_id=chat_id, text=job["text"], parse_mode=None)
+                metrics.BROADCAST_MESSAGES.inc(result="sent")
+                return True
+            except TelegramAPIError as e:
+                metrics.BROADCAST_MESSAGES.inc(result="failed")
+                log.warning(f"Рассылка {job_id}: не доставлено в чат {chat_id}: {e}")
+                return False
+
+    # Порция целиком отправляется параллельно, прогресс сохраняется после порции.
+    # При падении посреди порции её сообщения могут уйти повторно.
+    # Чат, привязанный к нескольким альянсам, получает сообщение один раз за задание
+    with background():
+        while has_targets:
+            targets = await alliances.get_bound_chats(pool, after=cursor, limit=BROADCAST_BATCH_SIZE,
+                                                      master_id=master_id)
+            if not targets:
+                break
+            chat_ids = await broadcasts.not_sent(redis, job_id, [target["chat_id"] for target in targets])
+            results = await asyncio.gather(*(send(chat_id) for chat_id in chat_ids))
+            sent += sum(results)
+            failed += len(results) - sum(results)
+            cursor = targets[-1]["id"]
+            await broadcasts.checkpoint(redis, job_id, cursor=cursor, sent=sent, failed=failed, chat_ids=chat_ids)
+            await broadcasts.extend(redis, job_id, ttl=LEASE_TTL)
+
+    await broadcasts.finish(redis, job_id)
+    log.info(f"Рассылка {job_id} завершена: доставлено {sent}, ошибок {failed}")
+    if not sent and not failed:
+        text = "Рассылка завершена: нет привязанных чатов."
+    else:
+        text = f"Рассылка завершена.\nДоставлено: {sent}\nНе доставлено: {failed}"
+    try:
+        await bot.send_message(chat_id=job["owner_id"], text=text)
+    except TelegramAPIError as e:
+        log.warning(f"Рассылка {job_id}: не удалось отправить отчёт автору: {e}")
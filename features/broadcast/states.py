@@ -0,0 +1,6 @@
+from aiogram.fsm.state import StatesGroup, State
+
+
+class BroadcastStates(StatesGroup):
+    input_text = State()
+    confirm = State()
@@ -0,0 +1,59 @@
+"""
+Данные всех кнопок бота.
+Префикс - тег, по которому CallbackRouter выбирает хендлеры, поэтому префиксы собраны здесь
+и должны быть уникальны на весь бот. Держим их короткими: данные кнопки ограничены 64 байтами
+"""
+from utils.callback import CompactCallbackData
+
+
+# =====[Общие]=====
+class Confirm(CompactCallbackData, prefix="ok"):
+    pass
+
+
+class Cancel(CompactCallbackData, prefix="no"):
+    pass
+
+
+# =====[Альянсы]=====
+class CreateAlliance(CompactCallbackData, prefix="ac"):
+    pass
+
+
+class AlliancePage(CompactCallbackData, prefix="ap"):
+    # True - следующая страница, False - предыдущая. cursor - id крайнего альянса текущей страницы
+    forward: bool
+    cursor: int
+
+
+class AllianceSettings(CompactCallbackData, prefix="as"):
+    alliance_id: int
+
+
+class RenameAlliance(CompactCallbackData, prefix="ar"):
+    pass
+
+
+class DeleteAlliance(CompactCallbackData, prefix="ad"):
+    pass
+
+
+class LinkChat(CompactCallbackData, prefix="al"):
+    pass
+
+
+class UnlinkChat(CompactCallbackData, prefix="au"):
+    pass
+
+
+class BackToAlliances(CompactCallbackData, prefix="ab"):
+    pass
+
+
+# =====[Рассылки]=====
+class BroadcastConfirm(CompactCallbackData, prefix="bo"):
+    pass
+
+
+class BroadcastCancel(CompactCallbackData, prefix="bn"):
+    pass
@@ -0,0 +1,14 @@
+from aiogram import Router
+from aiogram.types import CallbackQuery
+
+# Подключается последним: сюда доходят только кнопки, которые не разобрал ни один роутер
+router = Router(name="fallback")
+
+
+@router.callback_query()
+async def stale_button(call: CallbackQuery):
+    """
+    Кнопка старого сообщения: её данные в прежнем формате или сценарий уже завершён.
+    Отвечаем, чтобы у пользователя не висела загрузка на кнопке
+    """
+    await call.answer("Кнопка устарела, откройте меню заново", show_alert=True)
@@ -3,24 +3,36 @@ from typing import Union
 from aiogram.filters import BaseFilter
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
+from redis.asyncio import Redis
 
-from database.alliances import is_master_of_alliance
+from database.alliances import get_master_alliance
+from database.players import get_player_id
+from utils import metrics
 import asyncpg
 
 
 class IsAllianceMaster(BaseFilter):
     """
-    Проверка на мастера альянса
+    Проверка на мастера альянса.
+    Найденный альянс передаётся в хендлер параметром alliance, чтобы не запрашивать его повторно
     """
     async def __call__(self,
                        event: Union[Message, CallbackQuery],
                        state: FSMContext,
-                       pool: asyncpg.pool.Pool) -> bool:
-        data = await state.get_data()
-        alliance_id = data.get("alliance_id")
-        if not alliance_id:
-            return False
-        user_id = event.from_user.id
-        return await is_master_of_alliance(pool=pool,
-                                           alliance_id=alliance_id,
-                                           tg_id=user_id)
+                       pool: asyncpg.pool.Pool,
+                       redis: Redis) -> bool | dict:
+        with metrics.FILTER_SECONDS.time(filter="IsAllianceMaster"):
+            data = await state.get_data()
+            alliance_id = data.get("alliance_id")
+            if not alliance_id:
+                return False
+            master_id = await get_player_id(pool, tg_id=event.from_user.id, redis=redis)
+            if master_id is None:
+                return False
+            alliance = await get_master_alliance(pool=pool,
+                                                 alliance_id=alliance_id,
+                                                 master_id=master_id,
+                                                 redis=redis)
+            if alliance is None:
+                return False
+            return {"alliance": alliance}
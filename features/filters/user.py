@@ -1,18 +1,32 @@
-import asyncpg
 from aiogram.filters import BaseFilter
 from typing import Union
 
-from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery
 from redis.asyncio import Redis
 
+from config import BOT_ADMINS
+from redis_ import bind_requests
+from utils import metrics
+
 class HaveRequestByUser(BaseFilter):
-    def __init__(self,
-                 prefix: str):
-        self.prefix = prefix
+    """
+    Проверка заявки пользователя на привязку чата.
+    Заявка забирается из редиса сразу при проверке, ид альянса передаётся в хендлер параметром bind_alliance_id.
+    Лимиты роутера срабатывают раньше фильтров, поэтому отклонённый апдейт заявку не тратит
+    """
     async def __call__(self,
                         event: Union[Message, CallbackQuery],
-                        state: FSMContext,
-                        redis: Redis):
-        key = f"{self.prefix}:{event.from_user.id}"
-        return await redis.exists(key)
\ No newline at end of file
+                        redis: Redis) -> bool | dict:
+        with metrics.FILTER_SECONDS.time(filter="HaveRequestByUser"):
+            alliance_id = await bind_requests.consume(redis, event.from_user.id)
+        if alliance_id is None:
+            return False
+        return {"bind_alliance_id": alliance_id}
+
+
+class IsBotAdmin(BaseFilter):
+    """
+    Пользователь - администратор бота (BOT_ADMINS в конфиге)
+    """
+    async def __call__(self, event: Union[Message, CallbackQuery]) -> bool:
+        return event.from_user.id in BOT_ADMINS
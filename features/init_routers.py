@@ -1,11 +1,37 @@
 from aiogram import Router
 from .add_alliance import handlers as add_alliance_handlers
+from .add_alliance.handlers import AddAlliance
 from .settings_alliance import handlers as settings_alliance_handlers
+from .settings_alliance.states import UpdInfoAlliance
 from .add_guild import handlers as add_guild_handlers
+from .add_guild.states import AddGuildStates
+from .broadcast import handlers as broadcast_handlers
+from .broadcast.states import BroadcastStates
+from .profiler import handlers as profiler_handlers
+from .fallback import handlers as fallback_handlers
 
 def setup_routers() -> Router:
     main_router = Router()
     main_router.include_router(add_alliance_handlers.router)
     main_router.include_router(settings_alliance_handlers.router)
     main_router.include_router(add_guild_handlers.router)
-    return main_router
\ No newline at end of file
+    main_router.include_router(broadcast_handlers.router)
+    main_router.include_router(profiler_handlers.router)
+    # Последним: отвечает на кнопки, не подошедшие ни одному хендлеру
+    main_router.include_router(fallback_handlers.router)
+    return main_router
+
+def state_ttls() -> dict[str, int]:
+    """
+    Время жизни отдельных состояний FSM в секундах.
+    Ввод названий и подтверждения не должны висеть сутки, как меню
+    """
+    return {
+        AddAlliance.input_name.state: 60 * 60,
+        AddGuildStates.first_input_name.state: 60 * 60,
+        UpdInfoAlliance.entering_rename.state: 30 * 60,
+        UpdInfoAlliance.confirm_rename.state: 30 * 60,
+        UpdInfoAlliance.delete_alliance.state: 10 * 60,
+        BroadcastStates.input_text.state: 30 * 60,
+        BroadcastStates.confirm.state: 30 * 60,
+    }
@@ -0,0 +1,77 @@
+import math
+from pathlib import Path
+
+from aiogram import Bot, Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import FSInputFile, Message
+
+from features.filters.chat import TypeChat
+from features.filters.user import IsBotAdmin
+from utils import profiler
+
+router = Router(name="profiler")
+
+USAGE = ("Использование: /profile [секунды] [Nu] [sample|cprofile]\n"
+         "Например: /profile 30, /profile 500u, /profile 10 cprofile")
+
+
+def parse_args(args: str | None) -> dict | None:
+    """
+    Разбирает аргументы /profile: число - секунды, число с u - апдейты, sample или cprofile - режим
+    :param args: текст после команды
+    :return: аргументы для profiler.start или None, если разобрать не удалось
+    """
+    params = {}
+    for token in (args or "").lower().split():
+        if token in profiler.MODES:
+            params["mode"] = token
+        elif token.endswith("u") and token[:-1].isdigit() and int(token[:-1]) > 0:
+            params["updates"] = int(token[:-1])
+        else:
+            try:
+                params["seconds"] = float(token)
+            except ValueError:
+                return None
+            if not math.isfinite(params["seconds"]) or params["seconds"] <= 0:
+                return None
+    return params
+
+
+@router.message(Command("profile"),
+                TypeChat("private"),
+                IsBotAdmin())
+async def cmd_profile(msg: Message, command: CommandObject, bot: Bot) -> None:
+    """
+    Запуск профилирования, профиль по окончании приходит администратору файлом
+    :param msg:
+    :param command:
+    :param bot:
+    :return:
+    """
+    params = parse_args(command.args)
+    if params is None:
+        await msg.answer(text=USAGE)
+        return
+
+    chat_id = msg.chat.id
+
+    async def send_profile(path: Path) -> None:
+        await bot.send_document(chat_id=chat_id, document=FSInputFile(path), caption="Профиль готов")
+
+    if not profiler.start(on_done=send_profile, **params):
+        await msg.answer(text="Профилирование уже идёт, остановить - /profile\\_stop")
+        return
+    await msg.answer(text="Профилирование запущено")
+
+
+@router.message(Command("profile_stop"),
+                TypeChat("private"),
+                IsBotAdmin())
+async def cmd_profile_stop(msg: Message) -> None:
+    """
+    Досрочная остановка профилирования
+    :param msg:
+    :return:
+    """
+    if await profiler.stop() is None:
+        await msg.answer(text="Профилирование не запущено")
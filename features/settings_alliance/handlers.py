@@ -1,42 +1,47 @@
 import asyncpg
-from aiogram import Router, F
+from aiogram import F
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery
 from redis.asyncio import Redis
 
-from database import players
+from config import BIND_REQUEST_TTL
+from features.callbacks import (Confirm, Cancel, AlliancePage, AllianceSettings, RenameAlliance,
+                                 DeleteAlliance, LinkChat, UnlinkChat, BackToAlliances)
 from features.filters.chat import TypeChat
 from features.filters.shared import IsAllianceMaster
 from features.filters.user import HaveRequestByUser
 from utils import log
+from utils.callback import CallbackRouter
 from .keyboards import (cancel_keyboard,
-                        cancel_confirm_keyboard,
-                        alliance_list_keyboard)
+                        cancel_confirm_keyboard)
 from .logic import (get_alliance_list,
+                    get_alliance_page_keyboard,
                     get_action_menu,
                     create_bind_redis,
                     process_bind_chat,
                     process_unbind_chat, process_delete_alliance, process_alliance_rename)
 from .states import UpdInfoAlliance
 
-router = Router()
+router = CallbackRouter(name="settings_alliance")
 
 
 # Фикс
 @router.message(Command("my_alliances"))
-async def upd_alliance(msg: Message, state: FSMContext, pool: asyncpg.pool, **kwargs) -> None:
+async def upd_alliance(msg: Message, state: FSMContext, pool: asyncpg.pool, redis: Redis, **kwargs) -> None:
     """
     Вывод списка альянса
     :param msg: сообщение пользователя
     :param state: состояние
     :param pool: пул подключения к бд
+    :param redis: кэш альянсов
     :param kwargs: доп. данные
     :return: None
     """
     await state.set_state(UpdInfoAlliance.upd_alliances_list)
     alliance_data = await get_alliance_list(pool=pool,
-                                            user_id=msg.from_user.id)
+                                            user_id=msg.from_user.id,
+                                            redis=redis)
     if alliance_data is None:
         text = ("У вас нет альянса.\n"
                 "Введите /create_alliance, чтобы создать альянс.")
@@ -48,41 +53,53 @@ async def upd_alliance(msg: Message, state: FSMContext, pool: asyncpg.pool, **kw
 
 
 # Фикс
-@router.callback_query(F.data.startswith("page_"),
+@router.callback_query(AlliancePage.filter(),
                        UpdInfoAlliance.upd_alliances_list)
 async def paginate_alliances(call: CallbackQuery,
                              state: FSMContext,
-                             pool: asyncpg.pool) -> None:
+                             pool: asyncpg.pool,
+                             redis: Redis,
+                             callback_data: AlliancePage) -> None:
     """
     Перелистывание страниц
     :param call: кнопка
     :param state: состояние
     :param pool: пул подкллючения
+    :param redis: кэш альянсов
+    :param callback_data: направление и курсор страницы
     :return: None
     """
-    page = int(call.data.removeprefix("page_"))
-    alliances = await players.get_alliances_by_master(pool, call.from_user.id)
-
-    keyboard = alliance_list_keyboard(alliances, page=page)
+    keyboard = await get_alliance_page_keyboard(pool=pool,
+                                                user_id=call.from_user.id,
+                                                direction="next" if callback_data.forward else "prev",
+                                                cursor=callback_data.cursor,
+                                                redis=redis)
+    if keyboard is None:
+        await call.answer()
+        return
 
     await call.message.edit_reply_markup(reply_markup=keyboard)
     await call.answer()
 
 
 # Фикс
-@router.callback_query(F.data.startswith("settings_alliance_"),
+@router.callback_query(AllianceSettings.filter(),
                        UpdInfoAlliance.upd_alliances_list)
-async def show_alliance_actions(call: CallbackQuery, state: FSMContext, pool: asyncpg.Pool) -> None:
+async def show_alliance_actions(call: CallbackQuery, state: FSMContext, pool: asyncpg.Pool, redis: Redis,
+                                callback_data: AllianceSettings) -> None:
     """
     Вывод настроек альянса
     :param call: кнопка
     :param state: состояние
     :param pool: пул к бд
+    :param redis: кэш альянсов
+    :param callback_data: выбранный альянс
     :return: None
     """
-    alliance_id = int(call.data.removeprefix("settings_alliance_"))
+    alliance_id = callback_data.alliance_id
     alliance_data = await get_action_menu(pool=pool,
-                                          alliance_id=alliance_id)
+                                          alliance_id=alliance_id,
+                                          redis=redis)
     if not alliance_data:
         log.error(f"Ошибка создания клавиатуры для альянса {alliance_id}")
         return
@@ -97,7 +114,7 @@ async def show_alliance_actions(call: CallbackQuery, state: FSMContext, pool: as
 
 # =====[Смена названия альянса]===== -Фикс
 @router.callback_query(UpdInfoAlliance.upd_alliances_menu,
-                       F.data == "rename_alliance")
+                       RenameAlliance.filter())
 async def start_rename_alliance(call: CallbackQuery, state: FSMContext) -> None:
     """
     Начало переименования альянса
@@ -133,15 +150,16 @@ async def input_alliance_name(msg: Message, state: FSMContext) -> None:
                      reply_markup=keyboard)
 
 
-@router.callback_query(F.data == "confirm",
+@router.callback_query(Confirm.filter(),
                        UpdInfoAlliance.confirm_rename,
                        IsAllianceMaster())
-async def confirm_alliance_rename(call: CallbackQuery, state: FSMContext, pool: asyncpg.pool) -> None:
+async def confirm_alliance_rename(call: CallbackQuery, state: FSMContext, pool: asyncpg.pool, redis: Redis) -> None:
     """
     Принятие нового названия
     :param call:
     :param state:
     :param pool:
+    :param redis:
     :return:
     """
     data = await state.get_data()
@@ -149,7 +167,9 @@ async def confirm_alliance_rename(call: CallbackQuery, state: FSMContext, pool:
     result = await process_alliance_rename(
         alliance_id=data["alliance_id"],
         new_name=data.get("new_name"),
-        pool=pool
+        user_id=call.from_user.id,
+        pool=pool,
+        redis=redis
     )
 
     if result["success"]:
@@ -163,14 +183,15 @@ async def confirm_alliance_rename(call: CallbackQuery, state: FSMContext, pool:
     await call.answer()
 
 
-@router.callback_query(F.data == "cancel",
+@router.callback_query(Cancel.filter(),
                        StateFilter(UpdInfoAlliance.confirm_rename, UpdInfoAlliance.entering_rename))
-async def cancel_alliance_rename(call: CallbackQuery, state: FSMContext, pool: asyncpg.pool) -> None:
+async def cancel_alliance_rename(call: CallbackQuery, state: FSMContext, pool: asyncpg.pool, redis: Redis) -> None:
     """
     Отмена переименования названия
     :param call:
     :param state:
     :param pool:
+    :param redis:
     :return:
     """
     data = await state.get_data()
@@ -178,7 +199,8 @@ async def cancel_alliance_rename(call: CallbackQuery, state: FSMContext, pool: a
     text = "Переименование отменено"
     msg_keyboard_data = await get_action_menu(pool=pool,
                                               alliance_id=alliance_id,
-                                              custom_text=text)
+                                              custom_text=text,
+                                              redis=redis)
     await call.message.edit_text(text=msg_keyboard_data["text"],
                                  reply_markup=msg_keyboard_data["keyboard"])
 
@@ -187,7 +209,7 @@ async def cancel_alliance_rename(call: CallbackQuery, state: FSMContext, pool: a
 
 
 # =====[Удаление альянса]=====
-@router.callback_query(F.data.startswith("delete_alliance"),
+@router.callback_query(DeleteAlliance.filter(),
                        IsAllianceMaster())
 async def start_delete_alliance(call: CallbackQuery, state: FSMContext):
     """
@@ -205,14 +227,15 @@ async def start_delete_alliance(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@router.callback_query(F.data == "cancel",
+@router.callback_query(Cancel.filter(),
                        UpdInfoAlliance.delete_alliance)
-async def cancel_alliance_rename(call: CallbackQuery, state: FSMContext, pool: asyncpg.pool) -> None:
+async def cancel_alliance_rename(call: CallbackQuery, state: FSMContext, pool: asyncpg.pool, redis: Redis) -> None:
     """
     Отмена удаления альянса
     :param call:
     :param state:
     :param pool:
+    :param redis:
     :return:
     """
     data = await state.get_data()
@@ -220,7 +243,8 @@ async def cancel_alliance_rename(call: CallbackQuery, state: FSMContext, pool: a
     text = "Удаление отменено"
     msg_keyboard_data = await get_action_menu(pool=pool,
                                               alliance_id=alliance_id,
-                                              custom_text=text)
+                                              custom_text=text,
+                                              redis=redis)
     await call.message.edit_text(text=msg_keyboard_data["text"],
                                  reply_markup=msg_keyboard_data["keyboard"])
 
@@ -231,20 +255,22 @@ async def cancel_alliance_rename(call: CallbackQuery, state: FSMContext, pool: a
 @router.message(F.text,
                 UpdInfoAlliance.delete_alliance,
                 IsAllianceMaster())
-async def confirm_delete_alliance(msg: Message, state: FSMContext, pool: asyncpg.pool):
+async def confirm_delete_alliance(msg: Message, state: FSMContext, pool: asyncpg.pool, redis: Redis, alliance: dict):
     """
     Подтверждение удаления альянса
     :param msg:
     :param state:
     :param pool:
+    :param redis:
+    :param alliance: альянс из фильтра IsAllianceMaster
     :return:
     """
-    data = await state.get_data()
     result = await process_delete_alliance(
         user_id=msg.from_user.id,
-        alliance_id=data["alliance_id"],
+        alliance_id=alliance["id"],
         entered_name=msg.text.strip(),
-        pool=pool
+        pool=pool,
+        redis=redis
     )
 
     await msg.answer(
@@ -263,21 +289,22 @@ async def confirm_delete_alliance(msg: Message, state: FSMContext, pool: asyncpg
 
 
 # =====[Привязка чата]=====
-@router.callback_query(F.data.startswith("link_chat"),
+@router.callback_query(LinkChat.filter(),
                        UpdInfoAlliance.upd_alliances_menu,
                        IsAllianceMaster())
 async def start_bind_chat(call: CallbackQuery,
                           state: FSMContext,
-                          redis: Redis):
+                          redis: Redis,
+                          alliance: dict):
     """
     Начало привязки чата к альянсу
     :param call:
     :param state:
     :param redis:
+    :param alliance: альянс из фильтра IsAllianceMaster
     :return:
     """
-    data = await state.get_data()
-    alliance_id = data.get("alliance_id")
+    alliance_id = alliance["id"]
     user_id = call.from_user.id
 
     await create_bind_redis(redis=redis,
@@ -287,26 +314,29 @@ async def start_bind_chat(call: CallbackQuery,
             "\n"
             "`/confirm_chat`\n"
             "\n"
-            "_Время действия: 5 минут._")
+            f"_Время действия: {BIND_REQUEST_TTL // 60} мин._")
     await call.message.edit_text(text=text)
 
 
 @router.message(Command("confirm_chat"),
                 TypeChat(["group", "supergroup"]),
-                HaveRequestByUser("guild_transfer"))
+                HaveRequestByUser())
 async def confirm_chat_link(msg: Message,
                             state: FSMContext,
                             pool: asyncpg.pool,
-                            redis: Redis):
+                            redis: Redis,
+                            bind_alliance_id: int):
     """
     Подтверждение привязки чата к альянсу
     :param msg:
     :param state:
     :param pool:
     :param redis:
+    :param bind_alliance_id: альянс из заявки, забранной фильтром HaveRequestByUser
     :return:
     """
-    result = await process_bind_chat(user_id=msg.from_user.id, chat_id=msg.chat.id, pool=pool, redis=redis)
+    result = await process_bind_chat(user_id=msg.from_user.id, chat_id=msg.chat.id, alliance_id=bind_alliance_id,
+                                     pool=pool, redis=redis)
     if isinstance(result, str):
         await msg.answer(f"❌ {result}")
     elif result:
@@ -315,25 +345,26 @@ async def confirm_chat_link(msg: Message,
         await msg.answer(f"❌ Проблема с привязкой чата")
 
 
-@router.callback_query(F.data.startswith("unlink_chat"),
+@router.callback_query(UnlinkChat.filter(),
                        UpdInfoAlliance.upd_alliances_menu,
                        IsAllianceMaster())
-async def unbind_chat(call: CallbackQuery, state: FSMContext, pool: asyncpg.pool):
+async def unbind_chat(call: CallbackQuery, state: FSMContext, pool: asyncpg.pool, redis: Redis, alliance: dict):
     """
     Отвязка чата от альянса
     :param call:
     :param state:
     :param pool:
+    :param redis:
+    :param alliance: альянс из фильтра IsAllianceMaster
     :return:
     """
-    data = await state.get_data()
-    alliance_id = data.get("alliance_id")
+    alliance_id = alliance["id"]
 
-    result = await process_unbind_chat(user_id=call.from_user.id, alliance_id=alliance_id, pool=pool)
+    result = await process_unbind_chat(user_id=call.from_user.id, alliance_id=alliance_id, pool=pool, redis=redis)
 
     if result:
         text = "🔄 Чат успешно отвязан от альянса."
-        keyboard_msg_data = await get_action_menu(pool=pool, alliance_id=alliance_id, custom_text=text)
+        keyboard_msg_data = await get_action_menu(pool=pool, alliance_id=alliance_id, custom_text=text, redis=redis)
         await call.message.edit_text(text=keyboard_msg_data["text"],
                                      reply_markup=keyboard_msg_data["keyboard"])
     else:
@@ -341,18 +372,20 @@ async def unbind_chat(call: CallbackQuery, state: FSMContext, pool: asyncpg.pool
         return
 
 
-@router.callback_query(F.data == "back_to_alliances",
+@router.callback_query(BackToAlliances.filter(),
                        UpdInfoAlliance.upd_alliances_menu)
-async def back_to_alliances(call: CallbackQuery, state: FSMContext, pool: asyncpg.Pool):
+async def back_to_alliances(call: CallbackQuery, state: FSMContext, pool: asyncpg.Pool, redis: Redis):
     """
     Возврат в меню выбора альянса
     :param call:
     :param state:
     :param pool:
+    :param redis:
     :return:
     """
     alliance_data = await get_alliance_list(pool=pool,
-                                            user_id=call.from_user.id)
+                                            user_id=call.from_user.id,
+                                            redis=redis)
     if alliance_data is None:
         await call.message.edit_text(text="У вас нет альянса.\n"
                                           "Введите /create_alliance, чтобы создать альянс.",
@@ -1,33 +1,46 @@
-from math import ceil
+from functools import lru_cache
 
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from config import KEYBOARD_CACHE_SIZE
+from features.callbacks import (Confirm, Cancel, AlliancePage, AllianceSettings, RenameAlliance,
+                                 DeleteAlliance, LinkChat, UnlinkChat, BackToAlliances)
+from utils.markup import intern
+
+# Кол-во альянсов на одной странице списка
+ALLIANCES_PER_PAGE = 5
+
+# Клавиатуры ниже не меняются после создания: одинаковые вызовы получают один и тот же объект
+
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def confirm_keyboard(name_button: str = "Принять",
-                     callback_name: str = "confirm") -> InlineKeyboardMarkup:
+                     callback_name: str = Confirm().pack()) -> InlineKeyboardMarkup:
     """
     Создает кнопку для подтверждения чего-либо с кастомным названием
     :param callback_name: название callback_data
     :param name_button: название кнопки. По умолчанию "Принять"
     :return: кнопку
     """
-    return InlineKeyboardMarkup(inline_keyboard=[
+    return intern(InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=name_button,
                               callback_data=callback_name)]
-    ])
+    ]))
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def cancel_keyboard(name_button: str = "Отмена",
-                    callback_name: str = "cancel") -> InlineKeyboardMarkup:
+                    callback_name: str = Cancel().pack()) -> InlineKeyboardMarkup:
     """
     Создается кнопку для возврата в главное меню
     :param callback_name: название callback_data
     :param name_button: название кнопки. По умолчанию "Отмена"
     :return: Возвращает клавиатуру с кнопкой "Назад"
     """
-    return InlineKeyboardMarkup(inline_keyboard=[
+    return intern(InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=name_button,
                               callback_data=callback_name)]
-    ])
+    ]))
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def cancel_confirm_keyboard(name_button_cancel: str = "Отмена",
                           name_button_confirm: str = "Принять") -> InlineKeyboardMarkup:
     """
@@ -36,82 +49,87 @@ def cancel_confirm_keyboard(name_button_cancel: str = "Отмена",
     :param name_button_confirm: название кнопки принятия. По умолчанию "Окей"
     :return: Возвращает клавиатуру с кнопками "Назад" и "Вперед"
     """
-    return InlineKeyboardMarkup(inline_keyboard=[
+    return intern(InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=name_button_confirm,
-                              callback_data="confirm")],
+                              callback_data=Confirm().pack())],
         [InlineKeyboardButton(text=name_button_cancel,
-                              callback_data="cancel")]
-    ])
+                              callback_data=Cancel().pack())]
+    ]))
 
-def action_keyboard(alliance_id: int, has_chat: bool) -> InlineKeyboardMarkup:
+def action_keyboard(has_chat: bool) -> InlineKeyboardMarkup:
     """
-    Клавиатура для действий с альянсами
-    :param alliance_id: ид альянса
+    Клавиатура для действий с альянсами.
+    Альянс берётся из состояния, поэтому вариантов всего два - с чатом и без, оба собраны заранее
     :param has_chat: привязан ли чат
     :return:
     """
+    return _ACTION_KEYBOARDS[bool(has_chat)]
+
+def _build_action_keyboard(has_chat: bool) -> InlineKeyboardMarkup:
     keyboard = [
-        [InlineKeyboardButton(text="✏️ Редактировать название", callback_data=f"rename_alliance")],
+        [InlineKeyboardButton(text="✏️ Редактировать название", callback_data=RenameAlliance().pack())],
         # [InlineKeyboardButton(text="🛠 Состав альянса", callback_data=f"edit_members")],
         # [InlineKeyboardButton(text="🔁 Передать мастера", callback_data=f"transfer_master")],
         [InlineKeyboardButton(
             text="🚪 Отвязать чат" if has_chat else "🔗 Привязать чат",
-            callback_data=f"{'unlink' if has_chat else 'link'}_chat"
+            callback_data=(UnlinkChat() if has_chat else LinkChat()).pack()
         )],
-        [InlineKeyboardButton(text="🗑 Удалить альянс", callback_data=f"delete_alliance")],
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_alliances")]
+        [InlineKeyboardButton(text="🗑 Удалить альянс", callback_data=DeleteAlliance().pack())],
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data=BackToAlliances().pack())]
     ]
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+    return intern(InlineKeyboardMarkup(inline_keyboard=keyboard))
 
-def alliance_list_keyboard(alliances: list[dict],
-                           page: int = 1,
-                           per_page: int = 5) -> InlineKeyboardMarkup:
+_ACTION_KEYBOARDS = {has_chat: _build_action_keyboard(has_chat) for has_chat in (False, True)}
+
+def alliance_list_keyboard(page: dict) -> InlineKeyboardMarkup:
     """
-    Строит клавиатуру для вывода списка альянсов. Если у пользователя количество выводимых альянсов >5,
-    то вывод разбивается на страницы по 5 альянсов на каждый
-    :param alliances: альянсы пользователя
-    :param page: выводимая страница
-    :param per_page: кол-во выводимых страниц
+    Строит клавиатуру для вывода одной страницы списка альянсов (по ALLIANCES_PER_PAGE на страницу).
+    Кнопки навигации несут id крайнего альянса страницы - от него БД отсчитывает соседнюю страницу
+    :param page: страница альянсов {"items": list[dict], "has_prev": bool, "has_next": bool}
     :return: клавиатура с альянсами
     """
-    # Вычисление выводимых кол-ва альянсы
-    total = len(alliances)
-    total_pages = ceil(total / per_page)
-    page = max(1, min(page, total_pages))
-
-    start = (page - 1) * per_page
-    end = start + per_page
-    current_slice = alliances[start:end]
+    items = tuple((alliance["id"], alliance["name"]) for alliance in page["items"])
+    return _alliance_list_keyboard(items, page["has_prev"], page["has_next"])
 
+@lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def _alliance_list_keyboard(items: tuple[tuple[int, str], ...],
+                            has_prev: bool,
+                            has_next: bool) -> InlineKeyboardMarkup:
     keyboard: list[list[InlineKeyboardButton]] = []
 
     # Кнопки альянсов
-    for alliance in current_slice:
+    for alliance_id, name in items:
         keyboard.append([
             InlineKeyboardButton(
-                text=alliance["name"],
-                callback_data=f"settings_alliance_{alliance['id']}"
+                text=name,
+                callback_data=AllianceSettings(alliance_id=alliance_id).pack()
             )
         ])
 
     # Кнопки навигации
     nav_buttons = []
-    if page > 1:
+    if items and has_prev:
         nav_buttons.append(
             InlineKeyboardButton(
                 text="◀️ Назад",
-                callback_data=f"page_{page - 1}"
+                callback_data=AlliancePage(forward=False, cursor=items[0][0]).pack()
             )
         )
-    if page < total_pages:
+    if items and has_next:
         nav_buttons.append(
             InlineKeyboardButton(
                 text="▶️ Далее",
-                callback_data=f"page_{page + 1}"
+                callback_data=AlliancePage(forward=True, cursor=items[-1][0]).pack()
             )
         )
 
     if nav_buttons:
         keyboard.append(nav_buttons)
 
-    return InlineKeyboardMarkup(inline_keyboard=keyboard)
\ No newline at end of file
+    return intern(InlineKeyboardMarkup(inline_keyboard=keyboard))
+
+
+# Собираем статичные клавиатуры заранее, при импорте
+cancel_keyboard(name_button="Отменить")
+cancel_keyboard(name_button="Назад")
+cancel_confirm_keyboard(name_button_cancel="Отменить", name_button_confirm="Изменить")
@@ -1,48 +1,86 @@
-import json
-
 import asyncpg
+from aiogram.types import InlineKeyboardMarkup
 from redis.asyncio import Redis
 
-from database import alliances
+from database import alliances, players
+from redis_ import bind_requests
 from utils import log
-from .keyboards import alliance_list_keyboard, action_keyboard
+from .keyboards import alliance_list_keyboard, action_keyboard, ALLIANCES_PER_PAGE
 
 
 async def get_alliance_list(pool: asyncpg.pool,
                             user_id: int,
-                            custom_text: str = "") -> dict | None:
+                            custom_text: str = "",
+                            redis: Redis | None = None) -> dict | None:
     """
     Создает меню со списком альянса с кастомным текстом в сообщении
     :param pool:
     :param user_id:
     :param custom_text:
+    :param redis: кэш альянсов
     :return:
     """
-    alliances_data = await alliances.get_alliances_by_master(pool=pool,
-                                                       tg_id=user_id)
-    if not alliances_data:
+    master_id = await players.get_player_id(pool, tg_id=user_id, redis=redis)
+    if master_id is None:
+        return None
+    page = await alliances.get_alliances_page(pool=pool,
+                                              master_id=master_id,
+                                              limit=ALLIANCES_PER_PAGE,
+                                              redis=redis)
+    if not page["items"]:
         return None
 
     return {
         "text": (f"Выберите альянс, который нужно отредактировать\n"
                  f"\n"
                  f"{custom_text}"),
-        "keyboard": alliance_list_keyboard(alliances_data)
+        "keyboard": alliance_list_keyboard(page)
     }
 
 
+async def get_alliance_page_keyboard(pool: asyncpg.pool,
+                                     user_id: int,
+                                     direction: str,
+                                     cursor: int,
+                                     redis: Redis | None = None) -> InlineKeyboardMarkup | None:
+    """
+    Клавиатура соседней страницы списка альянсов
+    :param pool:
+    :param user_id:
+    :param direction: "next" или "prev"
+    :param cursor: id крайнего альянса текущей страницы
+    :param redis:
+    :return: клавиатура или None, если альянсов больше нет
+    """
+    master_id = await players.get_player_id(pool, tg_id=user_id, redis=redis)
+    if master_id is None:
+        return None
+    page = await alliances.get_alliances_page(pool=pool,
+                                              master_id=master_id,
+                                              limit=ALLIANCES_PER_PAGE,
+                                              after=cursor if direction == "next" else None,
+                                              before=cursor if direction == "prev" else None,
+                                              redis=redis)
+    if not page["items"]:
+        return None
+    return alliance_list_keyboard(page)
+
+
 async def get_action_menu(pool: asyncpg.pool.Pool,
                           alliance_id: int,
-                          custom_text: str = "") -> dict | None:
+                          custom_text: str = "",
+                          redis: Redis | None = None) -> dict | None:
     """
     Создает меню для редактирования альянса: смена названия, редактирование тг чата, удаление альянса
     :param pool:
     :param alliance_id:
     :param custom_text:
+    :param redis: кэш альянсов
     :return:
     """
     alliance_info = await alliances.get_alliance_info(pool=pool,
-                                                     alliance_id=alliance_id)
+                                                     alliance_id=alliance_id,
+                                                     redis=redis)
     if not alliance_info:
         return None
 
@@ -50,32 +88,41 @@ async def get_action_menu(pool: asyncpg.pool.Pool,
             f"Выберите действие для альянса «{alliance_info["name"]}»:")
     return {
         "text": text,
-        "keyboard": action_keyboard(alliance_id=alliance_id,
-                                    has_chat=bool(alliance_info["chat_id"]))
+        "keyboard": action_keyboard(has_chat=bool(alliance_info["chat_id"]))
     }
 
 
 async def rename_alliance(pool: asyncpg.pool.Pool,
                           alliance_id: int,
-                          new_name: str) -> None:
+                          new_name: str,
+                          user_id: int,
+                          redis: Redis | None = None) -> bool:
     """
     Запуск процесса редактирования названия альянса
     :param pool:
     :param alliance_id:
     :param new_name:
-    :return:
+    :param user_id: Telegram ID пользователя, мастер проверяется в том же запросе
+    :param redis:
+    :return: False, если пользователь не мастер альянса
     """
-    await alliances.upd_alliance_name(pool=pool,
-                                     alliance_id=alliance_id,
-                                     new_name=new_name)
+    master_id = await players.get_player_id(pool, tg_id=user_id, redis=redis)
+    return await alliances.upd_alliance_name(pool=pool,
+                                            alliance_id=alliance_id,
+                                            new_name=new_name,
+                                            master_id=master_id,
+                                            redis=redis)
 
 
-async def process_alliance_rename(alliance_id: int, new_name: str | None, pool: asyncpg.pool) -> dict:
+async def process_alliance_rename(alliance_id: int, new_name: str | None, user_id: int, pool: asyncpg.pool,
+                                  redis: Redis | None = None) -> dict:
     """
     Процесс редактирования ника. После ввода нового названия альянса - идет обработка и после чего добавляется в БД.
     :param alliance_id:
     :param new_name:
+    :param user_id:
     :param pool:
+    :param redis:
     :return:
     """
     if not new_name:
@@ -84,12 +131,18 @@ async def process_alliance_rename(alliance_id: int, new_name: str | None, pool:
             "error": f"Ошибка при сохранении названия альянса {alliance_id}: не указано новое название"
         }
 
-    await rename_alliance(pool=pool, alliance_id=alliance_id, new_name=new_name)
+    if not await rename_alliance(pool=pool, alliance_id=alliance_id, new_name=new_name,
+                                 user_id=user_id, redis=redis):
+        return {
+            "success": False,
+            "error": f"Попытка переименовать не свой альянс. tg_id: {user_id}, alliance_id: {alliance_id}"
+        }
 
     msg_keyboard_data = await get_action_menu(
         pool=pool,
         alliance_id=alliance_id,
-        custom_text=f"Название альянса обновлено на {new_name}"
+        custom_text=f"Название альянса обновлено на {new_name}",
+        redis=redis
     )
 
     if not msg_keyboard_data:
@@ -117,75 +170,63 @@ async def create_bind_redis(redis: Redis,
     :param user_id:
     :return:
     """
-    key = f"guild_transfer:{int(user_id)}"
-    value = json.dumps({
-        "user_id": int(user_id),
-        "alliance_id": int(alliance_id)
-    })
-    await redis.setex(key, 300, value)  # TTL 5 минут
+    await bind_requests.create(redis=redis, user_id=user_id, alliance_id=alliance_id)
 
 
-async def process_bind_chat(user_id: int, chat_id: int, pool: asyncpg.pool, redis: Redis) -> str | bool:
+async def process_bind_chat(user_id: int, chat_id: int, alliance_id: int, pool: asyncpg.pool,
+                            redis: Redis) -> str | bool:
     """
     Процесс привязки чата к гильдии
     1) Пользователь вводи команду в чате
-    2) Если запись в редис есть на добавление, то добавляет ид чат
-    3) Если записи нет, то игнор (На верхнем уровне)
+    2) Фильтр забирает заявку на привязку из редис и передаёт ид альянса
+    3) Если заявки нет, то игнор (На верхнем уровне)
     :param user_id:
     :param chat_id:
+    :param alliance_id: ид альянса из заявки
     :param pool:
     :param redis:
     :return:
     """
-    redis_key = f"guild_transfer:{user_id}"
-    data = await redis.get(redis_key)
-    if not data:
-        return "Нет данных для привязки."
-
-    try:
-        binding_data = json.loads(data)
-        alliance_id = int(binding_data["alliance_id"])
-    except (KeyError, ValueError, json.JSONDecodeError):
-        log.error(f"Ошибка: повреждённые данные в записи (guild_transfer:{user_id})")
-        return False
-
-
-    if not await alliances.is_master_of_alliance(pool, tg_id=user_id, alliance_id=alliance_id):
+    # Незарегистрированный пользователь (None) не совпадёт ни с одним мастером - запрос вернёт is_master=False
+    master_id = await players.get_player_id(pool, tg_id=user_id, redis=redis)
+    result = await alliances.bind_chat_by_master(pool, alliance_id=alliance_id, master_id=master_id,
+                                                 chat_id=chat_id, redis=redis)
+    if not result["is_master"]:
         log.warning(f"Попытка привязать не свой альянс. tg_id: {user_id} || alliance_id: {alliance_id}")
         return False
 
-    alliance_data = await alliances.get_alliance_info(pool, alliance_id)
-    if alliance_data["chat_id"]:
+    if not result["success"]:
         log.warning(f"Попытка привязать чат к альянсу, у которого он уже привязан. tg_id: {user_id} || alliance_id: {alliance_id}")
         return "У альянса уже привязан чат."
 
-    await alliances.bind_chat_to_alliance(pool, alliance_id, chat_id)
-    await redis.delete(redis_key)
     return True
 
 
-async def process_unbind_chat(user_id: int, alliance_id: int, pool: asyncpg.pool) -> bool | str:
+async def process_unbind_chat(user_id: int, alliance_id: int, pool: asyncpg.pool,
+                              redis: Redis | None = None) -> bool | str:
     """
     Процесс отвязки чата
     :param user_id:
     :param alliance_id:
     :param pool:
+    :param redis:
     :return:
     """
-    if not await alliances.is_master_of_alliance(pool, tg_id=user_id, alliance_id=alliance_id):
+    master_id = await players.get_player_id(pool, tg_id=user_id, redis=redis)
+    result = await alliances.unbind_chat_by_master(pool, alliance_id=alliance_id, master_id=master_id, redis=redis)
+    if not result["is_master"]:
         log.warning(f"Попытка отвязать чата не от своего альянса. tg_id: {user_id}, alliance_id: {alliance_id}")
         return False
 
-    alliance_data = await alliances.get_alliance_info(pool, alliance_id)
-    if not alliance_data["chat_id"]:
+    if not result["success"]:
         log.warning(f"Попытка отвязать не привязанный чат к альянсу. tg_id: {user_id}, alliance_id: {alliance_id}")
         return False
 
-    await alliances.bind_chat_to_alliance(pool, alliance_id, None)
     return True
 
 
-async def process_delete_alliance(user_id: int, alliance_id: int, entered_name: str, pool: asyncpg.pool) -> dict:
+async def process_delete_alliance(user_id: int, alliance_id: int, entered_name: str, pool: asyncpg.pool,
+                                  redis: Redis | None = None) -> dict:
     """
     Процесс удаления альянса
     Возвращает словарь:
@@ -196,26 +237,23 @@ async def process_delete_alliance(user_id: int, alliance_id: int, entered_name:
         "has_other_alliances": bool
     }
     """
-    alliance_name = await alliances.get_alliance_name(pool, alliance_id)
+    master_id = await players.get_player_id(pool, tg_id=user_id, redis=redis)
+    result = await alliances.delete_alliance_by_master(pool, alliance_id=alliance_id, master_id=master_id,
+                                                       name=entered_name, limit=ALLIANCES_PER_PAGE, redis=redis)
 
-    if entered_name != alliance_name:
-        alliance_info = await alliances.get_alliance_info(pool=pool, alliance_id=alliance_id)
+    if not result["success"]:
+        if not result["is_master"]:
+            log.warning(f"Попытка удалить не свой альянс. tg_id: {user_id}, alliance_id: {alliance_id}")
         return {
             "success": False,
             "text": "Название не совпадает. Удаление отменено.",
-            "keyboard": action_keyboard(
-                alliance_id=alliance_id,
-                has_chat=bool(alliance_info["chat_id"])
-            )
+            "keyboard": action_keyboard(has_chat=bool(result["chat_id"]))
         }
 
-    await alliances.delete_alliance(pool, alliance_id)
-
-    alliances_data = await alliances.get_alliances_by_master(pool, user_id)
+    page = result["page"]
     return {
         "success": True,
         "text": "Альянс удалён.",
-        "keyboard": alliance_list_keyboard(alliances_data) if alliances else None,
-        "has_other_alliances": bool(alliances)
+        "keyboard": alliance_list_keyboard(page) if page["items"] else None,
+        "has_other_alliances": bool(page["items"])
     }
-
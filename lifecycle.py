@@ -0,0 +1,42 @@
+import time
+from typing import Any, Awaitable, Callable
+
+from config import SHUTDOWN_DRAIN_TIMEOUT
+from dispatcher import BotDispatcher
+from utils import log
+
+
+class Lifecycle:
+    """
+    Порядок остановки бота.
+    Приём апдейтов к этому моменту уже остановлен (поллинг отменён или сервер вебхука закрыт),
+    поэтому сначала дожидаемся апдейтов в обработке, затем закрываем ресурсы в порядке регистрации.
+    Ошибка закрытия одного ресурса не мешает закрыть остальные
+    """
+
+    def __init__(self, dp: BotDispatcher, drain_timeout: float = SHUTDOWN_DRAIN_TIMEOUT):
+        self.dp = dp
+        self.drain_timeout = drain_timeout
+        self._closers: list[tuple[str, Callable[[], Awaitable[Any]]]] = []
+
+    def on_close(self, name: str, callback: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Регистрирует закрытие ресурса
+        :param name: название для лога
+        :param callback: корутинная функция без аргументов
+        """
+        self._closers.append((name, callback))
+
+    async def shutdown(self) -> None:
+        started = time.perf_counter()
+        if self.dp.in_flight:
+            log.info(f"Остановка: ждём {self.dp.in_flight} апдейтов в обработке")
+        if not await self.dp.wait_idle(self.drain_timeout):
+            log.warning(f"Остановка: за {self.drain_timeout} с не завершились {self.dp.in_flight} апдейтов")
+
+        for name, callback in self._closers:
+            try:
+                await callback()
+            except Exception as e:
+                log.error(f"Остановка: не удалось закрыть {name}: {e}")
+        log.info(f"Остановка заняла {(time.perf_counter() - started) * 1000:.0f} мс")
@@ -1,21 +1,234 @@
-from typing import Callable, Dict, Any, Awaitable
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Any, Awaitable, AsyncGenerator
 
-from aiogram import BaseMiddleware
+from aiogram import BaseMiddleware, Bot
 import asyncpg
-from aiogram.types import TelegramObject
-from redis.asyncio import Redis
-
-
-# class DBMiddleware(BaseMiddleware):
-#     def __init__(self, pool: asyncpg.pool, redis: Redis):
-#         self.pool = pool
-#         self.redis = redis
-#     async def __call__(
-#         self,
-#         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
-#         event: TelegramObject,
-#         data: Dict[str, Any]
-#     ) -> Any:
-#         data["pool"] = self.pool
-#         data["redis"] = self.redis
-#         return await handler(event, data)
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.methods import TelegramMethod
+from aiogram.types import CallbackQuery, TelegramObject, Update
+
+from database import chat_index
+from database.db import Replicas, UpdateConnection
+from redis_.throttle import Throttler
+from utils import metrics
+
+
+class _Slot:
+    """
+    Слот параллельной обработки апдейта, который можно временно отдать (см. update_idle)
+    """
+
+    def __init__(self, semaphore: asyncio.Semaphore):
+        self._semaphore = semaphore
+        self.held = False
+
+    async def acquire(self) -> None:
+        await self._semaphore.acquire()
+        self.held = True
+
+    def release(self) -> bool:
+        if not self.held:
+            return False
+        self.held = False
+        self._semaphore.release()
+        return True
+
+
+_slot: ContextVar[_Slot | None] = ContextVar("update_slot", default=None)
+_connection: ContextVar[UpdateConnection | None] = ContextVar("update_connection", default=None)
+
+
+@asynccontextmanager
+async def update_idle() -> AsyncGenerator[None, None]:
+    """
+    Апдейт ждёт не БД и не соседей, а внешнего лимита (очереди исходящих запросов к Bot API).
+    На это время подключение к БД возвращается в пул, а слот параллельной обработки достаётся
+    другим апдейтам. Очередь пользователя остаётся за апдейтом, порядок его апдейтов не меняется.
+    Вне обработки апдейта ничего не делает
+    """
+    conn = _connection.get()
+    if conn is not None:
+        await conn.suspend()
+    slot = _slot.get()
+    released = slot is not None and slot.release()
+    try:
+        yield
+    finally:
+        if released:
+            await slot.acquire()
+
+
+class OrderedEventIsolation(BaseEventIsolation):
+    """
+    Изоляция событий для параллельной обработки апдейтов.
+    Апдейты одного пользователя в чате (ключ FSM) выполняются строго по очереди в порядке поступления,
+    апдейты разных пользователей - параллельно, но не больше max_in_flight одновременно.
+    FSMContextMiddleware берёт этот лок до чтения состояния, поэтому следующий апдейт
+    пользователя всегда видит состояние, записанное предыдущим
+    """
+
+    def __init__(self, max_in_flight: int):
+        self._locks: Dict[StorageKey, asyncio.Lock] = {}
+        self._waiters: Dict[StorageKey, int] = {}
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                # Слот берём только после своей очереди, чтобы очередь одного пользователя
+                # не занимала слоты остальных
+                slot = _Slot(self._in_flight)
+                await slot.acquire()
+                token = _slot.set(slot)
+                try:
+                    yield
+                finally:
+                    _slot.reset(token)
+                    slot.release()
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def close(self) -> None:
+        self._locks.clear()
+        self._waiters.clear()
+
+
+class DBMiddleware(BaseMiddleware):
+    """
+    Выдаёт апдейту одно подключение к БД вместо пула.
+    Подключение берётся из пула при первом запросе фильтра или хендлера и возвращается после апдейта.
+    Ключ "pool" в данных хендлеров сохраняется, чтобы фильтры и database/* работали без изменений.
+    С репликами чтения апдейта уходят на них, записи пользователя закрепляют его чтения за primary
+    """
+
+    def __init__(self, pool: asyncpg.Pool, with_transaction: bool = False, replicas: Replicas | None = None):
+        self.pool = pool
+        self.with_transaction = with_transaction
+        self.replicas = replicas
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        conn = UpdateConnection(self.pool, with_transaction=self.with_transaction,
+                                replicas=self.replicas, user_id=user.id if user else None,
+                                redis=data.get("redis"))
+        data["pool"] = conn
+        token = _connection.set(conn)
+        failed = True
+        try:
+            result = await handler(event, data)
+            failed = False
+            return result
+        finally:
+            _connection.reset(token)
+            await conn.release(failed=failed)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Замеряет время хендлера. Регистрируется как внутренняя мидлварь, поэтому
+    срабатывает уже после фильтров и знает, какой хендлер выбран
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = data["handler"].callback.__name__
+        try:
+            with metrics.HANDLER_SECONDS.time(handler=name):
+                return await handler(event, data)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(handler=name)
+            raise
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Замеряет время вызовов Bot API
+    """
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        name = type(method).__name__
+        try:
+            with metrics.BOT_API_SECONDS.time(method=name):
+                return await make_request(bot, method)
+        except Exception:
+            metrics.BOT_API_ERRORS.inc(method=name)
+            raise
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Отклоняет апдейты сверх лимита частоты для пользователя и для чата.
+    На уровне диспетчера (апдейты) срабатывает под локом FSM, до фильтров и подключения к БД,
+    на уровне роутера (сообщения и кнопки) - для апдейтов, которые дошли до этого роутера, до его фильтров.
+    Отклонённая кнопка получает ответ, чтобы у пользователя не висели часики
+    """
+
+    def __init__(self, throttler: Throttler, scope: str, rate: float, burst: int):
+        self.throttler = throttler
+        self.scope = scope
+        self.rate = rate
+        self.burst = burst
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        keys = [f"throttle:{self.scope}:user:{user.id}"]
+        chat = data.get("event_chat")
+        if chat is not None and chat.id != user.id:
+            keys.append(f"throttle:{self.scope}:chat:{chat.id}")
+
+        if await self.throttler.allow(keys, rate=self.rate, burst=self.burst):
+            return await handler(event, data)
+
+        metrics.THROTTLED.inc(scope=self.scope)
+        call = event.callback_query if isinstance(event, Update) else event
+        if isinstance(call, CallbackQuery):
+            await call.answer("Слишком много запросов, подождите немного")
+        return None
+
+
+class ChatAllianceMiddleware(BaseMiddleware):
+    """
+    Для апдейтов из групп кладёт в данные хендлеров chat_alliance - альянс, к которому привязан чат
+    (None, если не привязан). Альянс берётся из индекса в памяти, без запроса к БД.
+    Сразу после запуска апдейты из групп ждут первой загрузки индекса
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        chat = data.get("event_chat")
+        if chat is not None and chat.type in ("group", "supergroup"):
+            if not chat_index.loaded():
+                await chat_index.wait_loaded()
+            data["chat_alliance"] = chat_index.get(chat.id)
+        return await handler(event, data)
@@ -0,0 +1,53 @@
+"""
+Миграции схемы БД.
+
+Запуск из корня репозитория:
+    python migrate.py           - применить новые миграции
+    python migrate.py status    - применённые и ожидающие миграции
+    python migrate.py check     - EXPLAIN запросов из реестра, код выхода 1, если какой-то читает таблицу целиком
+"""
+import argparse
+import asyncio
+import sys
+
+import asyncpg
+
+from config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
+from database import migrate
+from utils.logger import stop_logger
+
+
+async def main(command: str) -> int:
+    conn = await asyncpg.connect(user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT, database=DB_NAME)
+    try:
+        if command == "up":
+            names = await migrate.migrate(conn)
+            print(f"Применено миграций: {len(names)}" + (f" ({', '.join(names)})" if names else ""))
+            return 0
+
+        if command == "status":
+            done = await migrate.applied(conn)
+            for version, name, _ in migrate.available():
+                print(f"{version:04} {name:<40} {'применена' if version in done else 'ожидает'}")
+            return 0
+
+        problems = await migrate.check_plans(conn)
+        for name, tables in problems.items():
+            print(f"{name}: Seq Scan по {', '.join(tables)}")
+        if problems:
+            print(f"Запросов без подходящего индекса: {len(problems)}")
+            return 1
+        print("Все запросы из реестра используют индексы")
+        return 0
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("command", nargs="?", default="up", choices=("up", "status", "check"))
+    try:
+        code = asyncio.run(main(parser.parse_args().command))
+    finally:
+        stop_logger()
+    sys.exit(code)
@@ -0,0 +1,221 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageReplyMarkup, EditMessageText, TelegramMethod
+
+from config import (OUTGOING_GLOBAL_RATE, OUTGOING_CHAT_RATE, OUTGOING_GROUP_RATE, OUTGOING_CHAT_BURST,
+                    OUTGOING_MAX_RETRIES)
+from middleware import update_idle
+from utils import log, metrics
+from utils.cache import TTLCache
+
+# Чем меньше, тем раньше уходит запрос, когда общий лимит исчерпан
+PRIORITY_CALLBACK = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2
+
+_priority: ContextVar[int] = ContextVar("outgoing_priority", default=PRIORITY_DEFAULT)
+
+
+@contextmanager
+def background() -> Iterator[None]:
+    """
+    Запросы внутри блока (и в задачах, созданных из него) уступают очередь ответам пользователям.
+    Для рассылок и прочей фоновой отправки
+    """
+    token = _priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _ChatBudget:
+    """
+    Лимит одного чата с резервированием: каждый запрос сразу занимает токен (баланс может уйти в минус)
+    и ждёт, пока баланс не восстановится. Так запросы в чат уходят по очереди без отдельной очереди
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """
+        :return: сколько секунд ждать до отправки
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        # Telegram попросил подождать - сдвигаем баланс так, чтобы следующий токен появился через seconds
+        self.tokens = min(self.tokens, -seconds * self.rate)
+        self.updated = time.monotonic()
+
+
+class _GlobalGate:
+    """
+    Общий лимит бота. Пока токены есть, запросы проходят сразу,
+    когда кончились - выстраиваются по приоритету, и ответы на кнопки уходят раньше сообщений
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._waiters: list[tuple[int, int, asyncio.Future, Callable[[], bool] | None]] = []
+        self._seq = itertools.count()
+        self._pump: asyncio.Task | None = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        """
+        Берёт токен, если он есть и очереди нет
+        """
+        self._refill()
+        if not self._waiters and self.tokens >= 1 and time.monotonic() >= self.paused_until:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def wait(self, priority: int, stale: Callable[[], bool] | None = None) -> bool:
+        """
+        Встаёт в очередь за токеном
+        :param priority: приоритет запроса, меньше - раньше
+        :param stale: проверка, что запрос уже не нужен. Проверяется в момент выдачи токена
+        :return: False - запрос устарел, токен на него не потрачен
+        """
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future, stale))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        return await future
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def _run(self) -> None:
+        while self._waiters:
+            self._refill()
+            wait = max(self.paused_until - time.monotonic(), (1 - self.tokens) / self.rate)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future, stale = heapq.heappop(self._waiters)
+            # Запрос могли отменить, пока он ждал - токен достанется следующему
+            if future.done():
+                continue
+            if stale is not None and stale():
+                future.set_result(False)
+                continue
+            self.tokens -= 1
+            future.set_result(True)
+
+
+class OutgoingScheduler(BaseRequestMiddleware):
+    """
+    Планировщик исходящих запросов к Bot API.
+    - общий лимит бота и отдельный лимит на каждый чат (в группах строже);
+    - ответы на кнопки не ждут лимита чата и идут первыми, когда общий лимит исчерпан;
+    - при 429 запрос повторяется через retry_after, а лимит чата (или общий) ставится на паузу;
+    - если пока edit_text/edit_reply_markup ждал очереди, то же сообщение успели отредактировать ещё раз,
+      устаревшая правка не отправляется и не тратит токен общего лимита;
+    - пока запрос ждёт лимита, апдейт отдаёт подключение к БД и слот обработки (middleware.update_idle).
+    Лимиты считаются в памяти процесса
+    """
+
+    def __init__(self,
+                 global_rate: float = OUTGOING_GLOBAL_RATE,
+                 chat_rate: float = OUTGOING_CHAT_RATE,
+                 group_rate: float = OUTGOING_GROUP_RATE,
+                 chat_burst: int = OUTGOING_CHAT_BURST,
+                 max_retries: int = OUTGOING_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = _GlobalGate(global_rate)
+        # Неактивные чаты вытесняются, их лимит начинается заново с полного
+        self._chats = TTLCache(maxsize=10000, ttl=60)
+        # (chat_id, message_id) -> номер последней правки
+        self._edits: dict[tuple[Any, int], int] = {}
+        self._edit_seq = itertools.count()
+
+    def _chat_budget(self, chat_id: Any) -> _ChatBudget:
+        budget = self._chats.get(chat_id)
+        if budget is None:
+            # У групп id отрицательные, у каналов и групп по username - строка
+            private = isinstance(chat_id, int) and chat_id > 0
+            budget = _ChatBudget(self.chat_rate if private else self.group_rate, self.chat_burst)
+            self._chats.set(chat_id, budget)
+        return budget
+
+    async def _wait_turn(self, chat_id: Any, priority: int, stale: Callable[[], bool] | None) -> bool:
+        """
+        Ждёт лимита чата, затем общего лимита
+        :return: False - правка устарела, пока ждала, токен общего лимита на неё не потрачен
+        """
+        delay = self._chat_budget(chat_id).reserve() if chat_id is not None else 0.0
+        if delay > 0:
+            async with update_idle():
+                await asyncio.sleep(delay)
+        if stale is not None and stale():
+            return False
+        if self._global.try_acquire():
+            return True
+        async with update_idle():
+            return await self._global.wait(priority, stale)
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Any:
+        is_callback = isinstance(method, AnswerCallbackQuery)
+        chat_id = None if is_callback else getattr(method, "chat_id", None)
+        edit_key = None
+        stale = None
+        if isinstance(method, (EditMessageText, EditMessageReplyMarkup)) and chat_id is not None:
+            edit_key = (chat_id, method.message_id)
+            edit_seq = self._edits[edit_key] = next(self._edit_seq)
+
+            def stale() -> bool:
+                return self._edits.get(edit_key) != edit_seq
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                started = time.perf_counter()
+                sent = await self._wait_turn(chat_id, PRIORITY_CALLBACK if is_callback else _priority.get(), stale)
+                metrics.BOT_API_QUEUE_SECONDS.observe(time.perf_counter() - started)
+                if not sent:
+                    metrics.BOT_API_COLLAPSED.inc()
+                    return True
+
+                try:
+                    return await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    if attempt == self.max_retries:
+                        raise
+                    metrics.BOT_API_RETRIES.inc(method=type(method).__name__)
+                    log.warning(f"Bot API: {type(method).__name__} упёрся в лимит, повтор через {e.retry_after} с")
+                    if chat_id is not None:
+                        self._chat_budget(chat_id).pause(e.retry_after)
+                    else:
+                        self._global.pause(e.retry_after)
+        finally:
+            if edit_key is not None and self._edits.get(edit_key) == edit_seq:
+                del self._edits[edit_key]
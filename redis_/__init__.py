@@ -1 +1,5 @@
-from . import config
\ No newline at end of file
+from . import config
+from . import storage
+from . import bind_requests
+from . import throttle
+from . import broadcasts
\ No newline at end of file
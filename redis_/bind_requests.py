@@ -0,0 +1,44 @@
+"""
+Заявки на привязку чата к альянсу.
+Мастер создаёт заявку из меню альянса, команда /confirm_chat в группе забирает её.
+Заявка хранится одним ключом на пользователя, значение - id альянса числом.
+Забирается атомарно через GETDEL: одну заявку не могут использовать два чата
+"""
+from redis.asyncio import Redis
+
+from config import BIND_REQUEST_TTL
+from utils import log
+
+PREFIX = "guild_transfer"
+
+
+def key(user_id: int) -> str:
+    return f"{PREFIX}:{int(user_id)}"
+
+
+async def create(redis: Redis, user_id: int, alliance_id: int, ttl: int = BIND_REQUEST_TTL) -> None:
+    """
+    Создаёт заявку, предыдущая заявка пользователя заменяется
+    :param redis:
+    :param user_id: Telegram ID мастера
+    :param alliance_id: ид альянса
+    :param ttl: время жизни заявки в секундах
+    """
+    await redis.set(key(user_id), int(alliance_id), ex=ttl)
+
+
+async def consume(redis: Redis, user_id: int) -> int | None:
+    """
+    Забирает заявку пользователя и удаляет её одним запросом
+    :param redis:
+    :param user_id: Telegram ID мастера
+    :return: ид альянса или None, если заявки нет
+    """
+    value = await redis.getdel(key(user_id))
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        log.error(f"Ошибка: повреждённые данные в записи ({key(user_id)})")
+        return None
@@ -0,0 +1,113 @@
+"""
+Задания рассылки в Redis.
+Задание - хеш с текстом, адресатами и прогрессом: курсор (id последнего обработанного альянса)
+и счётчики доставки. Незавершённые задания лежат в множестве ACTIVE и продолжаются после перезапуска.
+Выполнять задание может только один экземпляр бота - тот, кто держит его аренду.
+Чаты, куда задание уже отправило сообщение, хранятся в отдельном множестве: чат, привязанный
+к нескольким альянсам, получает объявление один раз
+"""
+import uuid
+
+from redis.asyncio import Redis
+
+ACTIVE = "broadcast:active"
+# Сколько хранить завершённое задание со статистикой
+FINISHED_TTL = 7 * 24 * 60 * 60
+
+
+def key(job_id: str) -> str:
+    return f"broadcast:job:{job_id}"
+
+
+def lease_key(job_id: str) -> str:
+    return f"broadcast:lease:{job_id}"
+
+
+def chats_key(job_id: str) -> str:
+    return f"broadcast:chats:{job_id}"
+
+
+async def create(redis: Redis, owner_id: int, scope: str, text: str) -> str:
+    """
+    Создаёт задание
+    :param redis:
+    :param owner_id: Telegram ID автора, ему придёт отчёт
+    :param scope: "master" - чаты альянсов автора, "all" - все привязанные чаты
+    :param text: текст объявления
+    :return: id задания
+    """
+    job_id = uuid.uuid4().hex[:12]
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(key(job_id), mapping={"owner_id": int(owner_id), "scope": scope, "text": text,
+                                        "status": "active", "cursor": 0, "sent": 0, "failed": 0})
+        pipe.sadd(ACTIVE, job_id)
+        await pipe.execute()
+    return job_id
+
+
+async def get(redis: Redis, job_id: str) -> dict | None:
+    job = await redis.hgetall(key(job_id))
+    if not job:
+        return None
+    for field in ("owner_id", "cursor", "sent", "failed"):
+        job[field] = int(job[field])
+    return job
+
+
+async def active(redis: Redis) -> list[str]:
+    return list(await redis.smembers(ACTIVE))
+
+
+async def acquire(redis: Redis, job_id: str, owner: str, ttl: int) -> bool:
+    """
+    Берёт аренду задания, если её не держит другой экземпляр
+    :param owner: метка экземпляра
+    :param ttl: срок аренды, секунды. Продлевается через extend
+    """
+    return bool(await redis.set(lease_key(job_id), owner, nx=True, ex=ttl))
+
+
+async def extend(redis: Redis, job_id: str, ttl: int) -> None:
+    await redis.expire(lease_key(job_id), ttl)
+
+
+async def not_sent(redis: Redis, job_id: str, chat_ids: list[int]) -> list[int]:
+    """
+    Чаты, в которые задание ещё не отправляло сообщение, без повторов
+    :param chat_ids: чаты очередной порции
+    """
+    chat_ids = list(dict.fromkeys(chat_ids))
+    if not chat_ids:
+        return []
+    done = await redis.smismember(chats_key(job_id), chat_ids)
+    return [chat_id for chat_id, is_done in zip(chat_ids, done) if not is_done]
+
+
+async def checkpoint(redis: Redis, job_id: str, cursor: int, sent: int, failed: int,
+                     chat_ids: list[int] = ()) -> None:
+    """
+    Сохраняет прогресс после порции
+    :param chat_ids: чаты, обработанные в порции
+    """
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(key(job_id), mapping={"cursor": cursor, "sent": sent, "failed": failed})
+        if chat_ids:
+            pipe.sadd(chats_key(job_id), *chat_ids)
+        await pipe.execute()
+
+
+async def finish(redis: Redis, job_id: str, status: str = "done") -> None:
+    """
+    Завершает задание: убирает из активных, освобождает аренду, статистика хранится FINISHED_TTL
+    :param status: "done" - отправлено, "failed" - прервано ошибкой
+    """
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(key(job_id), "status", status)
+        pipe.srem(ACTIVE, job_id)
+        pipe.expire(key(job_id), FINISHED_TTL)
+        pipe.delete(lease_key(job_id), chats_key(job_id))
+        await pipe.execute()
+
+
+async def release(redis: Redis, job_id: str) -> None:
+    await redis.delete(lease_key(job_id))
@@ -1,12 +1,27 @@
+from typing import Any
+
 from redis.asyncio import Redis
 from config import config
+from utils import metrics
+
+
+class TimedRedis(Redis):
+    """
+    Клиент Redis, который пишет время каждой команды в метрики.
+    Команды, отправленные через pipeline, не замеряются
+    """
+
+    async def execute_command(self, *args: Any, **options: Any) -> Any:
+        with metrics.REDIS_COMMAND_SECONDS.time(command=str(args[0]).upper()):
+            return await super().execute_command(*args, **options)
+
 
-async def init_redis(db: int = 0) -> Redis:
-    redis = Redis(host=config.DB_HOST,
-                  port=config.REDIS_PORT,
-                  db=db,
-                  password=config.REDIS_PASSWORD,
-                  decode_responses=True)
+async def init_redis(db: int = 0, decode_responses: bool = True) -> Redis:
+    redis = TimedRedis(host=config.DB_HOST,
+                       port=config.REDIS_PORT,
+                       db=db,
+                       password=config.REDIS_PASSWORD,
+                       decode_responses=decode_responses)
     try:
         await redis.ping()
     except Exception as e:
@@ -0,0 +1,88 @@
+from datetime import timedelta
+from typing import Any, Dict, Mapping, Optional
+
+import msgpack
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+from redis.asyncio import Redis
+
+# KEYS[1] - данные, KEYS[2] - состояние; ARGV[1] - данные, ARGV[2] - TTL данных по умолчанию ("" - без TTL).
+# Данные живут столько же, сколько состояние. Без TTL у состояния сохраняется TTL уже записанных данных,
+# и только новые данные получают TTL по умолчанию
+SET_DATA = """
+local ttl = redis.call('PTTL', KEYS[2])
+if ttl > 0 then
+    return redis.call('SET', KEYS[1], ARGV[1], 'PX', ttl)
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('SET', KEYS[1], ARGV[1], 'KEEPTTL')
+end
+if ARGV[2] ~= '' then
+    return redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+end
+return redis.call('SET', KEYS[1], ARGV[1])
+"""
+
+
+class CompactRedisStorage(RedisStorage):
+    """
+    Хранилище FSM в Redis.
+    Данные состояния хранятся в msgpack вместо JSON, а время жизни можно задать отдельно для каждого состояния.
+    Запись данных не продлевает их дольше состояния: TTL данных берётся у текущего состояния.
+    Клиент Redis должен быть создан с decode_responses=False
+    """
+
+    def __init__(self,
+                 redis: Redis,
+                 state_ttl: int | None = None,
+                 data_ttl: int | None = None,
+                 state_ttls: Mapping[str, int] | None = None,
+                 **kwargs: Any) -> None:
+        """
+        :param redis: клиент редиса
+        :param state_ttl: TTL состояния по умолчанию
+        :param data_ttl: TTL данных по умолчанию
+        :param state_ttls: TTL для отдельных состояний: "Group:state" -> секунды
+        """
+        super().__init__(redis=redis, state_ttl=state_ttl, data_ttl=data_ttl, **kwargs)
+        self.state_ttls = dict(state_ttls or {})
+        self._set_data = redis.register_script(SET_DATA)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state_key = self.key_builder.build(key, "state")
+        if state is None:
+            await self.redis.delete(state_key)
+            return
+
+        state_name = state.state if isinstance(state, State) else state
+        ttl = self.state_ttls.get(state_name, self.state_ttl)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(state_key, state_name, ex=ttl)
+            # Данные состояния живут не дольше самого состояния
+            if ttl is not None:
+                pipe.expire(self.key_builder.build(key, "data"), ttl)
+            await pipe.execute()
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            return await super().set_data(key, data)
+
+        data_key = self.key_builder.build(key, "data")
+        if not data:
+            await self.redis.delete(data_key)
+            return
+        await self._set_data(keys=[data_key, self.key_builder.build(key, "state")],
+                             args=[msgpack.packb(data, use_bin_type=True), self._ttl_seconds(self.data_ttl)])
+
+    @staticmethod
+    def _ttl_seconds(ttl: int | timedelta | None) -> int | str:
+        if ttl is None:
+            return ""
+        return int(ttl.total_seconds()) if isinstance(ttl, timedelta) else int(ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value: Optional[bytes] = await self.redis.get(self.key_builder.build(key, "data"))
+        if value is None:
+            return {}
+        return msgpack.unpackb(value, raw=False)
@@ -0,0 +1,97 @@
+"""
+Ограничение частоты апдейтов: token bucket в Redis, общий для всех экземпляров бота.
+Ведро пополняется со скоростью rate токенов в секунду до burst, каждый пропущенный апдейт забирает токен.
+Апдейт проверяется сразу по нескольким ведрам (пользователь и чат) одним скриптом Lua
+"""
+import time
+
+from redis.asyncio import Redis
+
+from utils import log
+from utils.cache import TTLCache
+
+# Сколько локальных вёдер держать в памяти процесса
+LOCAL_BUCKETS = 10000
+
+# KEYS - ведра, ARGV[1] - rate, ARGV[2] - burst.
+# Пропускает апдейт, только если токен есть в каждом ведре, и тогда забирает по токену из всех.
+# Время берётся у Redis, чтобы часы разных экземпляров бота не влияли на результат
+TOKEN_BUCKET = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local ttl = math.ceil(burst / rate * 1000)
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local left = tonumber(bucket[1])
+    if left == nil then
+        left = burst
+    else
+        left = math.min(burst, left + (now - tonumber(bucket[2])) * rate)
+    end
+    if left < 1 then
+        return 0
+    end
+    tokens[i] = left
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, ttl)
+end
+return 1
+"""
+
+
+class Throttler:
+    """
+    Проверка ведер в Redis с быстрым путём в памяти процесса.
+    Локальное ведро тратит токены только на апдейты, пропущенные Redis, поэтому в нём всегда
+    не меньше токенов, чем в общем. Пустое локальное ведро означает пустое общее - такой апдейт
+    отклоняется без похода в Redis. Если Redis недоступен, решает локальное ведро
+    """
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._script = redis.register_script(TOKEN_BUCKET)
+        # ключ ведра -> [токены, время обновления]
+        self._local = TTLCache(maxsize=LOCAL_BUCKETS)
+
+    async def allow(self, keys: list[str], rate: float, burst: int) -> bool:
+        """
+        Забирает по токену из каждого ведра, если во всех они есть
+        :param keys: ключи ведер
+        :param rate: пополнение, токенов в секунду
+        :param burst: вместимость ведра
+        :return: True - апдейт можно обрабатывать
+        """
+        now = time.monotonic()
+        buckets = [self._refill(key, now, rate, burst) for key in keys]
+        if any(bucket[0] < 1 for bucket in buckets):
+            return False
+        # Токены занимаются до похода в Redis, иначе одновременные апдейты все пройдут локальную проверку.
+        # Если Redis отказал, токены возвращаются - локальное ведро тратит только на пропущенные апдейты
+        for bucket in buckets:
+            bucket[0] -= 1
+
+        try:
+            allowed = bool(await self._script(keys=keys, args=[rate, burst]))
+        except Exception as e:
+            log.warning(f"Ошибка ограничителя частоты в Redis, решаем локально: {e}")
+            allowed = True
+
+        if not allowed:
+            for bucket in buckets:
+                bucket[0] += 1
+        return allowed
+
+    def _refill(self, key: str, now: float, rate: float, burst: int) -> list:
+        bucket = self._local.get(key)
+        if bucket is None:
+            bucket = [burst, now]
+            self._local.set(key, bucket)
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
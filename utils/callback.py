@@ -0,0 +1,133 @@
+"""
+Данные кнопок и их маршрутизация.
+CompactCallbackData - типизированные данные кнопки, целые числа упаковываются в base36.
+CallbackRouter - роутер, который выбирает хендлеры кнопки по префиксу её данных за O(1):
+фильтры проверяются только у хендлеров этого префикса и у хендлеров без CallbackData-фильтра
+"""
+import types
+from typing import Any, Dict, List, Optional, Union, get_args, get_origin
+
+from aiogram import Router
+from aiogram.dispatcher.event.bases import UNHANDLED, SkipHandler
+from aiogram.dispatcher.event.handler import CallbackType, HandlerObject
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.filters.callback_data import CallbackData, CallbackQueryFilter
+from aiogram.types import CallbackQuery
+
+SEPARATOR = ":"
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def encode_int(value: int) -> str:
+    """
+    Целое число в base36. Обратно - int(value, 36)
+    """
+    if value < 0:
+        return "-" + encode_int(-value)
+    if value < 36:
+        return _DIGITS[value]
+    digits = []
+    while value:
+        value, digit = divmod(value, 36)
+        digits.append(_DIGITS[digit])
+    return "".join(reversed(digits))
+
+
+def _is_int(annotation: Any) -> bool:
+    if annotation is int:
+        return True
+    return get_origin(annotation) in (Union, types.UnionType) and int in get_args(annotation)
+
+
+class CompactCallbackData(CallbackData, prefix=""):
+    """
+    Данные кнопки с целыми числами в base36: id Telegram из 10 цифр занимает 7 символов.
+    Префикс наследника - тег для CallbackRouter, он должен быть коротким и уникальным на весь бот
+    """
+    __int_fields__ = frozenset()
+
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs: Any) -> None:
+        super().__pydantic_init_subclass__(**kwargs)
+        if cls.__separator__ != SEPARATOR:
+            raise ValueError(f"{cls.__name__}: CallbackRouter понимает только разделитель {SEPARATOR!r}")
+        cls.__int_fields__ = frozenset(name for name, field in cls.model_fields.items()
+                                       if _is_int(field.annotation))
+
+    def _encode_value(self, key: str, value: Any) -> str:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return encode_int(value)
+        return super()._encode_value(key, value)
+
+    @classmethod
+    def unpack(cls, value: str) -> "CompactCallbackData":
+        prefix, *parts = value.split(SEPARATOR)
+        if prefix != cls.__prefix__:
+            raise ValueError(f"Bad prefix ({prefix!r} != {cls.__prefix__!r})")
+        names = cls.model_fields.keys()
+        if len(parts) != len(names):
+            raise TypeError(f"Callback data {cls.__name__!r} takes {len(names)} arguments "
+                            f"but {len(parts)} were given")
+        payload = {}
+        for name, part in zip(names, parts):
+            if name in cls.__int_fields__:
+                payload[name] = int(part, 36) if part else None
+            else:
+                payload[name] = part
+        return cls(**payload)
+
+
+class IndexedCallbackObserver(TelegramEventObserver):
+    """
+    Наблюдатель кнопок с индексом хендлеров по префиксу CallbackData-фильтра.
+    Хендлеры без такого фильтра (F.data, фильтры по состоянию) попадают в каждый список,
+    порядок регистрации сохраняется
+    """
+
+    def __init__(self, router: Router, event_name: str) -> None:
+        super().__init__(router=router, event_name=event_name)
+        self._by_tag: Dict[str, List[HandlerObject]] = {}
+        self._untagged: List[HandlerObject] = []
+
+    def register(self, callback: CallbackType, *filters: CallbackType,
+                 flags: Optional[Dict[str, Any]] = None, **kwargs: Any) -> CallbackType:
+        super().register(callback, *filters, flags=flags, **kwargs)
+        handler = self.handlers[-1]
+        tag = next((item.callback_data.__prefix__ for item in filters
+                    if isinstance(item, CallbackQueryFilter)), None)
+        if tag is None:
+            self._untagged.append(handler)
+            for handlers in self._by_tag.values():
+                handlers.append(handler)
+        else:
+            self._by_tag.setdefault(tag, list(self._untagged)).append(handler)
+        return callback
+
+    async def trigger(self, event: CallbackQuery, **kwargs: Any) -> Any:
+        # Тот же обход, что у TelegramEventObserver, но только по хендлерам префикса
+        tag = event.data.partition(SEPARATOR)[0] if event.data else None
+        for handler in self._by_tag.get(tag, self._untagged):
+            kwargs["handler"] = handler
+            result, data = await handler.check(event, **kwargs)
+            if result:
+                kwargs.update(data)
+                try:
+                    wrapped_inner = self.outer_middleware.wrap_middlewares(
+                        self._resolve_middlewares(),
+                        handler.call,
+                    )
+                    return await wrapped_inner(event, kwargs)
+                except SkipHandler:
+                    continue
+        return UNHANDLED
+
+
+class CallbackRouter(Router):
+    """
+    Роутер с индексом хендлеров кнопок по префиксу. С ростом числа хендлеров время выбора не растёт
+    """
+
+    def __init__(self, *, name: Optional[str] = None) -> None:
+        super().__init__(name=name)
+        self.callback_query = IndexedCallbackObserver(router=self, event_name="callback_query")
+        self.observers["callback_query"] = self.callback_query
@@ -3,8 +3,17 @@ from logging import handlers
 from logging.handlers import TimedRotatingFileHandler
 import queue
 import sys
+import threading
 from pathlib import Path
 
+_listener: logging.handlers.QueueListener | None = None
+_listener_lock = threading.Lock()
+_stopped = False
+_formatter = logging.Formatter(
+    '%(asctime)s | %(filename)s | %(levelname)s | %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
 
 def get_log_dir():
     base_path = Path(__file__).absolute().parent.parent
@@ -13,6 +22,50 @@ def get_log_dir():
     return log_dir
 
 
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Очередь логов, поток записи в файл и консоль запускается при первой записи.
+    Импорт модулей бота (бенчмарки, migrate.py, проверки) не создаёт logs/ и не запускает поток
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if _listener is None and not _stopped:
+            _start_listener(self.queue)
+        super().emit(record)
+
+
+def _start_listener(log_queue: queue.Queue) -> None:
+    global _listener
+    with _listener_lock:
+        if _listener is not None or _stopped:
+            return
+        # настройка логгера
+        # delay - файл открывается при первой записи в потоке слушателя
+        file_handler = TimedRotatingFileHandler(
+            filename=get_log_dir() / "application.log",
+            when="midnight",
+            interval=1,
+            backupCount=7,
+            encoding="utf-8",
+            delay=True
+        )
+        file_handler.setFormatter(_formatter)
+        file_handler.setLevel(logging.DEBUG)
+
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(_formatter)
+        console_handler.setLevel(logging.DEBUG)
+
+        listener = logging.handlers.QueueListener(
+            log_queue,
+            file_handler,
+            console_handler,
+            respect_handler_level=True
+        )
+        listener.start()
+        _listener = listener
+
+
 def setup_logger():
     logger = logging.getLogger("window_bot")
     logger.setLevel(logging.INFO)
@@ -20,41 +73,23 @@ def setup_logger():
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
 
-    formatter = logging.Formatter(
-        '%(asctime)s | %(filename)s | %(levelname)s | %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-
     # Очередь логов
     log_queue = queue.Queue(-1)
-    queue_handler = logging.handlers.QueueHandler(log_queue)
-    logger.addHandler(queue_handler)
-
-    # настройка логгера
-    file_handler = TimedRotatingFileHandler(
-        filename=get_log_dir() / "application.log",
-        when="midnight",
-        interval=1,
-        backupCount=7,
-        encoding="utf-8"
-    )
-    file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.DEBUG)
-
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
-    console_handler.setLevel(logging.DEBUG)
-
-    listener = logging.handlers.QueueListener(
-        log_queue,
-        file_handler,
-        console_handler,
-        respect_handler_level=True
-    )
-    listener.start()
-
+    logger.addHandler(_LazyQueueHandler(log_queue))
     return logger
 
 
+def stop_logger():
+    """
+    Останавливает поток записи логов, дописав всё, что осталось в очереди.
+    Вызывается последним при завершении процесса - записи после этого не попадут в файл
+    """
+    global _listener, _stopped
+    with _listener_lock:
+        _stopped = True
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
 log = setup_logger()
-log.info("Нам IIZ6a!")
\ No newline at end of file
@@ -0,0 +1,66 @@
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import InlineKeyboardMarkup, InputFile
+from aiohttp import FormData
+
+from config import KEYBOARD_CACHE_SIZE
+from .cache import TTLCache
+
+# id(клавиатуры) -> [клавиатура, её JSON]. Клавиатура хранится в записи,
+# поэтому её id не может достаться другому объекту, пока запись в кэше
+_interned = TTLCache(maxsize=KEYBOARD_CACHE_SIZE)
+
+
+def intern(markup: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+    """
+    Помечает готовую клавиатуру как переиспользуемую: её JSON будет собран один раз
+    при первой отправке и дальше браться из кэша.
+    Клавиатуру после этого нельзя менять
+    :param markup: клавиатура
+    :return: та же клавиатура
+    """
+    if _interned.get(id(markup)) is None:
+        _interned.set(id(markup), [markup, None])
+    return markup
+
+
+def _interned_entry(markup: Any) -> Optional[list]:
+    if markup is None:
+        return None
+    entry = _interned.get(id(markup))
+    if entry is None or entry[0] is not markup:
+        return None
+    return entry
+
+
+class MarkupCachingSession(AiohttpSession):
+    """
+    Сессия бота, которая не сериализует заново клавиатуры, помеченные через intern()
+    """
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod[Any]) -> FormData:
+        entry = _interned_entry(getattr(method, "reply_markup", None))
+        if entry is None:
+            return super().build_form_data(bot=bot, method=method)
+
+        if entry[1] is None:
+            entry[1] = self.prepare_value(entry[0], bot=bot, files={})
+
+        form = FormData(quote_fields=False)
+        files: Dict[str, InputFile] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", entry[1])
+        for key, value in files.items():
+            form.add_field(
+                key,
+                value.read(bot),
+                filename=value.filename or key,
+            )
+        return form
@@ -0,0 +1,175 @@
+"""
+Метрики бота в формате Prometheus.
+Гистограммы и счётчики живут в памяти процесса, отдаются aiohttp-эндпоинтом /metrics (см. start_metrics_server)
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Iterator
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+# Границы корзин по умолчанию, секунды: от миллисекунды до 10 секунд
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry: list["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Значение, которое считается в момент отдачи метрик
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def render(self) -> list[str]:
+        return super().render() + [f"{self.name} {self.function()}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [попадания по корзинам (последняя - +Inf), сумма, кол-во]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        item = self._values.get(key)
+        if item is None:
+            item = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        item[0][bisect_left(self.buckets, value)] += 1
+        item[1] += value
+        item[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Замеряет время выполнения блока, в том числе блока с await
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, hits in zip((*self.buckets, "+Inf"), counts):
+                cumulative += hits
+                le = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render() -> str:
+    """
+    Все метрики процесса в текстовом формате Prometheus
+    """
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+# =====[Метрики бота]=====
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время выполнения хендлера", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Хендлеры, завершившиеся исключением", ("handler",))
+FILTER_SECONDS = Histogram("bot_filter_seconds", "Время проверки фильтра", ("filter",))
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Время выполнения запроса к БД", ("query",))
+DB_POOL_WAIT_SECONDS = Histogram("db_pool_wait_seconds", "Ожидание свободного подключения в пуле")
+DB_REPLICA_FALLBACKS = Counter("db_replica_fallbacks_total", "Чтения, ушедшие на primary из-за реплик", ("reason",))
+REDIS_COMMAND_SECONDS = Histogram("redis_command_seconds", "Время выполнения команды Redis", ("command",))
+BOT_API_SECONDS = Histogram("bot_api_seconds", "Время вызова Bot API", ("method",))
+THROTTLED = Counter("bot_throttled_total", "Апдейты, отклонённые ограничителем частоты", ("scope",))
+BOT_API_ERRORS = Counter("bot_api_errors_total", "Вызовы Bot API, завершившиеся ошибкой", ("method",))
+BOT_API_QUEUE_SECONDS = Histogram("bot_api_queue_seconds", "Ожидание лимитов перед вызовом Bot API")
+BOT_API_RETRIES = Counter("bot_api_retries_total", "Повторы вызовов Bot API после 429", ("method",))
+BOT_API_COLLAPSED = Counter("bot_api_collapsed_total", "Правки сообщений, заменённые более новой правкой")
+BROADCAST_MESSAGES = Counter("bot_broadcast_messages_total", "Сообщения рассылок по результату", ("result",))
+
+
+def dump(path: str) -> None:
+    """
+    Записывает снимок метрик в файл, чтобы последние значения не пропали вместе с процессом
+    """
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(render())
+
+
+async def _handle_metrics(request: "web.Request") -> "web.Response":
+    from aiohttp import web
+    # Формат выдачи Prometheus 0.0.4: без version часть скрейперов не распознаёт текстовый формат
+    return web.Response(text=render(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8",
+                                 "X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(host: str, port: int) -> "web.AppRunner":
+    """
+    Поднимает эндпоинт /metrics. aiohttp.web импортируется только здесь - без эндпоинта он не нужен
+    :param host:
+    :param port:
+    :return: раннер, который нужно остановить через cleanup() при завершении
+    """
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return runner
@@ -0,0 +1,248 @@
+"""
+Профилирование работающего бота по команде администратора (/profile) или сигналу SIGUSR1.
+Профилируется поток event loop целиком: диспетчер, фильтры, хендлеры, database/* и вызовы Bot API.
+Режим sample - раз в PROFILE_SAMPLE_INTERVAL процессорного времени снимается стек потока event loop.
+Стоит порядка процента CPU, поэтому его можно включать под нагрузкой. Результат - свёрнутые стеки
+logs/profile-*.folded для flamegraph.pl или speedscope.
+Режим cprofile - cProfile с точным числом вызовов, результат в формате pstats (logs/profile-*.prof).
+Замедляет обработку в разы, включать на секунды.
+Сессия заканчивается через заданное время или после заданного числа апдейтов, что наступит раньше
+"""
+import asyncio
+import cProfile
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Awaitable, Callable
+
+from config import PROFILE_SAMPLE_INTERVAL, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS
+from utils import log
+from utils.logger import get_log_dir
+
+MODES = ("sample", "cprofile")
+
+_ROOT = Path(__file__).absolute().parent.parent
+_labels: dict[CodeType, str] = {}
+
+
+def _label(code: CodeType) -> str:
+    label = _labels.get(code)
+    if label is None:
+        path = Path(code.co_filename)
+        module = path.stem
+        # Путь от корня репозитория или от каталога sys.path: aiogram/dispatcher/dispatcher, а не dispatcher
+        for root in (_ROOT, *sorted((Path(item) for item in sys.path if item), key=lambda item: -len(item.parts))):
+            if path.is_relative_to(root):
+                module = path.relative_to(root).with_suffix("").as_posix()
+                break
+        # ";" разделяет кадры в свёрнутом стеке, пробел - стек и число сэмплов
+        name = getattr(code, "co_qualname", code.co_name)
+        label = _labels[code] = f"{module}:{name}".replace(";", ",").replace(" ", "_")
+    return label
+
+
+class _Stacks:
+    """
+    Счётчик сэмплированных стеков. Стеки копятся как кортежи code-объектов, в текст переводятся при записи
+    """
+
+    def __init__(self):
+        self._stacks: Counter[tuple[CodeType, ...]] = Counter()
+
+    def add(self, frame: FrameType | None) -> None:
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        self._stacks[tuple(stack)] += 1
+
+    def dump(self, path: Path) -> Path:
+        path = path.with_suffix(".folded")
+        with open(path, "w", encoding="utf-8") as file:
+            for stack, count in self._stacks.most_common():
+                file.write(";".join(_label(code) for code in reversed(stack)) + f" {count}\n")
+        log.info(f"Профилировщик: {sum(self._stacks.values())} сэмплов, {len(self._stacks)} разных стеков")
+        return path
+
+
+class _SignalSampler(_Stacks):
+    """
+    Сэмплер на SIGPROF: таймер процессорного времени прерывает поток event loop, обработчик сигнала
+    записывает прерванный стек. Простой в ожидании сети таймер не считает, поэтому профиль показывает,
+    на что уходит процессор. Ожидание БД и Bot API видно в метриках
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self._interval = interval
+        self._previous = None
+
+    def start(self) -> None:
+        self._previous = signal.signal(signal.SIGPROF, self._handle)
+        signal.setitimer(signal.ITIMER_PROF, self._interval, self._interval)
+
+    def _handle(self, signum: int, frame: FrameType | None) -> None:
+        self.add(frame)
+
+    def stop(self, path: Path) -> Path:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous)
+        return self.dump(path)
+
+
+class _ThreadSampler(_Stacks):
+    """
+    Сэмплер в отдельном потоке для платформ без setitimer (Windows).
+    Получает GIL, когда поток event loop сам его отпускает, поэтому недооценивает короткие участки кода
+    между ожиданиями и переоценивает ожидание в select
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self._interval = interval
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            self.add(sys._current_frames().get(self._thread_id))
+
+    def stop(self, path: Path) -> Path:
+        self._stop.set()
+        self._thread.join()
+        return self.dump(path)
+
+
+class _CProfiler:
+    """
+    cProfile на потоке, из которого вызван start - то есть на потоке event loop
+    """
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self._profile.enable()
+
+    def stop(self, path: Path) -> Path:
+        self._profile.disable()
+        path = path.with_suffix(".prof")
+        self._profile.dump_stats(path)
+        return path
+
+
+class _Session:
+    def __init__(self, mode: str, updates: int | None,
+                 on_done: Callable[[Path], Awaitable[None]] | None):
+        self.mode = mode
+        self.updates_left = updates
+        self.on_done = on_done
+        self.started = time.perf_counter()
+        self.path = get_log_dir() / f"profile-{datetime.now():%Y%m%d-%H%M%S}-{mode}"
+        if mode == "sample" and hasattr(signal, "setitimer"):
+            self.collector = _SignalSampler(PROFILE_SAMPLE_INTERVAL)
+        elif mode == "sample":
+            self.collector = _ThreadSampler(PROFILE_SAMPLE_INTERVAL)
+        else:
+            self.collector = _CProfiler()
+        self.timer: asyncio.Task | None = None
+
+
+_session: _Session | None = None
+
+
+def is_running() -> bool:
+    return _session is not None
+
+
+def start(seconds: float | None = None, updates: int | None = None, mode: str = "sample",
+          on_done: Callable[[Path], Awaitable[None]] | None = None) -> bool:
+    """
+    Запускает профилирование. Вызывается из потока event loop
+    :param seconds: сколько секунд профилировать, не больше PROFILE_MAX_SECONDS.
+     None - PROFILE_DEFAULT_SECONDS, а если задан updates - PROFILE_MAX_SECONDS
+    :param updates: после скольких обработанных апдейтов остановиться, None - без ограничения
+    :param mode: sample или cprofile
+    :param on_done: корутинная функция, которая получит путь к файлу профиля
+    :return: False, если профилирование уже идёт
+    """
+    global _session
+    if _session is not None:
+        return False
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим профилирования {mode}, доступны {MODES}")
+    if seconds is None:
+        seconds = PROFILE_MAX_SECONDS if updates else PROFILE_DEFAULT_SECONDS
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+
+    _session = _Session(mode, updates, on_done)
+    _session.collector.start()
+    _session.timer = asyncio.create_task(_stop_after(seconds))
+    log.info(f"Профилировщик запущен: {mode}, {seconds:g} с"
+             + (f" или {updates} апдейтов" if updates else ""))
+    return True
+
+
+async def _stop_after(seconds: float) -> None:
+    await asyncio.sleep(seconds)
+    await stop()
+
+
+async def stop() -> Path | None:
+    """
+    Останавливает профилирование и записывает профиль в logs/
+    :return: путь к файлу профиля или None, если профилирование не шло
+    """
+    global _session
+    session, _session = _session, None
+    if session is None:
+        return None
+    if session.timer is not None and session.timer is not asyncio.current_task():
+        session.timer.cancel()
+
+    path = session.collector.stop(session.path)
+    log.info(f"Профилировщик остановлен через {time.perf_counter() - session.started:.1f} с, профиль: {path}")
+    if session.on_done is not None:
+        try:
+            await session.on_done(path)
+        except Exception as e:
+            log.error(f"Ошибка отправки профиля {path.name}: {e}")
+    return path
+
+
+def update_finished() -> None:
+    """
+    Отмечает обработанный апдейт. Вызывается диспетчером после каждого апдейта
+    """
+    if _session is None or _session.updates_left is None:
+        return
+    _session.updates_left -= 1
+    if _session.updates_left == 0:
+        asyncio.create_task(stop())
+
+
+def _toggle() -> None:
+    if is_running():
+        asyncio.create_task(stop())
+    else:
+        start()
+
+
+def install_signal_handler() -> None:
+    """
+    SIGUSR1 запускает профилирование в режиме sample на PROFILE_DEFAULT_SECONDS, повторный - останавливает.
+    На платформах без SIGUSR1 (Windows) остаётся только команда /profile
+    """
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, _toggle)
+    except (AttributeError, NotImplementedError, RuntimeError):
+        log.info("Профилировщик: SIGUSR1 недоступен, запуск только командой /profile")
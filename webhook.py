@@ -0,0 +1,122 @@
+import asyncio
+import signal
+from contextlib import suppress
+from typing import Any, Dict
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+                    WEBHOOK_QUEUE_SIZE, UPDATES_MAX_PENDING, SHUTDOWN_DRAIN_TIMEOUT)
+from utils import log
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука с ограниченной очередью.
+    Апдейт кладётся в очередь и Telegram сразу получает 200, обработку ведут воркеры.
+    Если очередь заполнена дольше put_timeout - отвечаем 503, и Telegram повторит доставку позже
+    """
+
+    def __init__(self,
+                 dispatcher: Dispatcher,
+                 bot: Bot,
+                 secret_token: str,
+                 queue_size: int,
+                 workers: int,
+                 put_timeout: float = 5,
+                 **data: Any) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True,
+                         secret_token=secret_token, **data)
+        self.put_timeout = put_timeout
+        self._queue: asyncio.Queue[Dict[str, Any]] = asyncio.Queue(maxsize=queue_size)
+        self._workers_count = workers
+        self._workers: list[asyncio.Task] = []
+
+    def register(self, app: web.Application, /, path: str, **kwargs: Any) -> None:
+        app.on_startup.append(self._start_workers)
+        super().register(app, path=path, **kwargs)
+
+    async def _start_workers(self, *a: Any, **kw: Any) -> None:
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self._queue.get()
+            try:
+                await self._background_feed_update(bot=self.bot, update=update)
+            except Exception as e:
+                log.error(f"Ошибка обработки апдейта {update.get('update_id')} из вебхука: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        try:
+            await asyncio.wait_for(self._queue.put(update), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Очередь вебхука переполнена, апдейт {update.get('update_id')} отклонён")
+            return web.Response(status=503)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self) -> None:
+        """
+        Дожидается обработки уже принятых апдейтов (не дольше SHUTDOWN_DRAIN_TIMEOUT) и останавливает воркеры.
+        Сессию бота закрывает on_shutdown диспетчера
+        """
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=SHUTDOWN_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning(f"Очередь вебхука не разобрана за {SHUTDOWN_DRAIN_TIMEOUT} с, "
+                        f"потеряно апдейтов: {self._queue.qsize()}")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """
+    Запускает aiohttp-сервер для приёма апдейтов через вебхук
+    :param dp: диспетчер
+    :param bot: бот
+    """
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise RuntimeError("Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+
+    app = web.Application()
+    # Хендлер регистрируется до диспетчера, чтобы при остановке сначала дообработать очередь,
+    # а уже потом закрыть пул и хранилище
+    handler = QueuedRequestHandler(dispatcher=dp,
+                                   bot=bot,
+                                   secret_token=WEBHOOK_SECRET,
+                                   queue_size=WEBHOOK_QUEUE_SIZE,
+                                   workers=UPDATES_MAX_PENDING)
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    async def set_webhook(*a: Any, **kw: Any) -> None:
+        await bot.set_webhook(url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+                              secret_token=WEBHOOK_SECRET,
+                              allowed_updates=dp.resolve_used_update_types())
+        log.info(f"Вебхук установлен, слушаем {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    app.on_startup.append(set_webhook)
+
+    # SIGTERM/SIGINT останавливают сервер штатно: сначала перестаём принимать запросы,
+    # потом разбираем очередь и только после этого вызывается остановка диспетчера
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    try:
+        await stop.wait()
+        log.info("Получен сигнал остановки, закрываем вебхук")
+    finally:
+        await runner.cleanup()